@@ -0,0 +1,87 @@
+"""
+per-case overhead of the scheduler: many short cases, a few at a time.
+overhead is the wall time beyond the sleeps of the cases, divided by
+the number of cases. the same cases also run in a fixed-interval polling
+loop, like the one the scheduler replaced, as the baseline
+
+    python benchmark/scheduler.py [cases] [processes] [budget in ms]
+"""
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ojpacker import scheduler, ui, utiliy  # noqa: E402
+
+sleep = 0.02
+# of the polling baseline
+interval = 0.1
+
+
+def jobs(temp: str, cases: int) -> List[utiliy.popen]:
+    return [
+        utiliy.popen(f"sh -c 'cat; sleep {sleep}'",
+                     typ="s2f",
+                     input=str(i),
+                     output=os.path.join(temp, f"{i}.out"))
+        for i in range(cases)
+    ]
+
+
+def polling(pool: List[utiliy.popen], processes: int) -> None:
+    """
+    the loop before the scheduler: check every job each `interval`,
+    start the next one for every job done
+    """
+    running = pool[:processes]
+    waiting = pool[processes:]
+    for job in running:
+        job.start()
+    while running:
+        time.sleep(interval)
+        for job in list(running):
+            if job.check():
+                running.remove(job)
+                if waiting:
+                    waiting[0].start()
+                    running.append(waiting.pop(0))
+
+
+def event(pool: List[utiliy.popen], processes: int) -> None:
+    runner = scheduler.scheduler(processes)
+    for job in pool:
+        runner.add(job)
+    runner.run()
+
+
+def measure(run: Callable[[List[utiliy.popen], int], None], cases: int,
+            processes: int) -> float:
+    """
+    ms of overhead per case
+    """
+    with tempfile.TemporaryDirectory() as temp:
+        pool = jobs(temp, cases)
+        begin = time.perf_counter()
+        run(pool, processes)
+        wall = time.perf_counter() - begin
+    return (wall - cases * sleep / processes) / cases * 1000
+
+
+def main() -> int:
+    cases = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    budget = float(sys.argv[3]) if len(sys.argv) > 3 else 15.0
+    ui.set_log_level("warning")
+    before = measure(polling, cases, processes)
+    after = measure(event, cases, processes)
+    print(f"{cases} cases, {processes} at a time, overhead per case: "
+          f"polling every {interval}s {before:.1f} ms, "
+          f"scheduler {after:.1f} ms (budget {budget} ms)")
+    return 0 if after <= budget else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+"""
+import time of the command line, which every call of ojpacker pays.
+rich, the stages and the archive are imported when they are used,
+this fails if one of them is imported by `import ojpacker.arg`,
+or if the import takes longer than the budget (-X importtime)
+
+    python benchmark/startup.py [budget in ms]
+"""
+import os
+import subprocess
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# imported only when a run starts
+lazy = ["rich", "ojpacker.workflow", "ojpacker.archive"]
+
+probe = f"""
+import sys
+import ojpacker.arg
+print(" ".join(name for name in {lazy!r} if name in sys.modules))
+"""
+
+
+def main() -> int:
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else 60.0
+    env = dict(os.environ, PYTHONPATH=root)
+    times = []
+    for _ in range(5):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", probe],
+                                env=env,
+                                cwd=root,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE,
+                                universal_newlines=True,
+                                check=True)
+        loaded = result.stdout.split()
+        if loaded:
+            print(f"imported by ojpacker.arg: {', '.join(loaded)}")
+            return 1
+        # import time: self [us] | cumulative | imported package
+        total = 0
+        for line in result.stderr.splitlines():
+            parts = line.split("|")
+            # nested imports are indented, they are in the cumulative
+            if len(parts) == 3 and parts[2].startswith(" ojpacker"):
+                total += int(parts[1])
+        times.append(total / 1000)
+    best = min(times)
+    print(f"import ojpacker.arg: {best:.1f} ms (budget {budget} ms)")
+    return 0 if best <= budget else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,6 @@
 from __future__ import absolute_import
 
 from .entrance import start
-from .error import OjpackerError
\ No newline at end of file
+from .error import OjpackerError
+from .config import RunConfig
+from .packer import Packer, PackResult
@@ -0,0 +1,493 @@
+from __future__ import absolute_import
+
+import abc
+import lzma
+import os
+import shutil
+import stat
+import struct
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import IO, Any, Dict, List, Optional, Tuple, Union
+
+from . import trace
+from .error import OjpackerError
+from .ui import log
+
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+# members smaller than this are compressed in memory
+spool_size = 16 * 1024 * 1024
+chunk_size = 1 << 20
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+zip64_limit = 0xFFFFFFFF
+
+# format -> (suffix, codec)
+formats: Dict[str, Tuple[str, str]] = {
+    "zip": (".zip", "deflate"),
+    "store": (".zip", "store"),
+    "tar": (".tar", ""),
+    "tar.gz": (".tar.gz", "gz"),
+    "tar.xz": (".tar.xz", "xz"),
+    "tar.zst": (".tar.zst", "zst"),
+}
+
+# codec -> (default level, min level, max level)
+levels: Dict[str, Tuple[int, int, int]] = {
+    "deflate": (6, 0, 9),
+    "store": (0, 0, 0),
+    "": (0, 0, 0),
+    "gz": (6, 0, 9),
+    "xz": (6, 0, 9),
+    "zst": (3, 1, 22),
+}
+
+
+def suffix(format: str) -> str:
+    return formats[format][0]
+
+
+@log
+def check(format: str, level: Optional[int]) -> None:
+    if format not in formats:
+        raise OjpackerError(f"unknown archive format '{format}', "
+                            f"use one of {', '.join(formats)}")
+    codec = formats[format][1]
+    if codec == "zst" and zstandard is None:
+        raise OjpackerError("tar.zst needs the package 'zstandard'")
+    _, low, high = levels[codec]
+    if level is not None and not low <= level <= high and low != high:
+        raise OjpackerError(
+            f"compression level of {format} should be in [{low}, {high}]")
+
+
+def compressor(codec: str, level: int) -> Any:
+    """
+    an object with compress() and flush(), every one makes a whole stream.
+    concatenated streams are still a valid file of gz, xz and zst
+    """
+    if codec == "gz":
+        return zlib.compressobj(level, zlib.DEFLATED, 31)
+    if codec == "xz":
+        return lzma.LZMACompressor(preset=level)
+    if codec == "zst":
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    raise OjpackerError(f"unknown codec '{codec}'")
+
+
+class member:
+    """
+    a file compressed and ready to be copied into the archive
+    """
+    def __init__(self,
+                 name: str,
+                 path: str,
+                 level: int,
+                 old: Optional[zipfile.ZipInfo] = None,
+                 base: str = "") -> None:
+        """
+        old is the member of the same name in the zip base,
+        its compressed data is copied if the content is the same
+        """
+        begin = time.perf_counter()
+        self.name = name
+        self.path = path
+        info = os.stat(path)
+        self.mode = info.st_mode
+        self.date_time = time.localtime(info.st_mtime)[:6]
+        self.size = 0
+        self.compress_size = 0
+        self.crc = 0
+        self.offset = 0
+        self.data: Optional[IO[bytes]] = None
+        # (zip, offset) of the data reused from an old zip
+        self.source: Optional[Tuple[str, int]] = None
+        self.method = ZIP_DEFLATED if level else ZIP_STORED
+        if old is not None and old.file_size == info.st_size:
+            self.checksum()
+            if self.crc == old.CRC:
+                self.reuse(base, old)
+            elif self.method == ZIP_DEFLATED:
+                self.crc = self.size = 0
+                self.deflate(level)
+        elif self.method == ZIP_DEFLATED:
+            self.deflate(level)
+        else:
+            self.checksum()
+        self.time = time.perf_counter() - begin
+
+    def reuse(self, base: str, old: zipfile.ZipInfo) -> None:
+        with open(base, "rb") as fp:
+            fp.seek(old.header_offset)
+            header = fp.read(30)
+        name_length, extra_length = struct.unpack("<HH", header[26:30])
+        self.source = (base, old.header_offset + 30 + name_length +
+                       extra_length)
+        self.method = old.compress_type
+        self.compress_size = old.compress_size
+
+    def checksum(self) -> None:
+        """
+        stored member, the file itself is copied later
+        """
+        with open(self.path, "rb") as fp:
+            for chunk in iter(lambda: fp.read(chunk_size), b""):
+                self.crc = zlib.crc32(chunk, self.crc)
+                self.size += len(chunk)
+        self.compress_size = self.size
+
+    def deflate(self, level: int) -> None:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        self.data = tempfile.SpooledTemporaryFile(spool_size)
+        with open(self.path, "rb") as fp:
+            for chunk in iter(lambda: fp.read(chunk_size), b""):
+                self.crc = zlib.crc32(chunk, self.crc)
+                self.size += len(chunk)
+                self.data.write(compressor.compress(chunk))
+        self.data.write(compressor.flush())
+        self.compress_size = self.data.tell()
+        self.data.seek(0)
+
+    def dos_time(self) -> Tuple[int, int]:
+        year, month, day, hour, minute, second = self.date_time
+        if year < 1980:
+            year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+        return ((hour << 11) | (minute << 5) | (second // 2),
+                ((year - 1980) << 9) | (month << 5) | day)
+
+    def flags(self) -> int:
+        try:
+            self.name.encode("ascii")
+            return 0
+        except UnicodeEncodeError:
+            return 0x800  # utf-8 name
+
+    def local_header(self) -> bytes:
+        name = self.name.encode()
+        extra = b""
+        size, compress_size = self.size, self.compress_size
+        version = 20
+        if size >= zip64_limit or compress_size >= zip64_limit:
+            extra = struct.pack("<HHQQ", 1, 16, size, compress_size)
+            size = compress_size = zip64_limit
+            version = 45
+        mtime, mdate = self.dos_time()
+        return struct.pack(
+            "<IHHHHHIIIHH",
+            0x04034B50,
+            version,
+            self.flags(),
+            self.method,
+            mtime,
+            mdate,
+            self.crc,
+            compress_size,
+            size,
+            len(name),
+            len(extra),
+        ) + name + extra
+
+    def central_header(self) -> bytes:
+        name = self.name.encode()
+        fields: List[int] = []
+        size, compress_size, offset = self.size, self.compress_size, self.offset
+        if size >= zip64_limit:
+            fields.append(size)
+            size = zip64_limit
+        if compress_size >= zip64_limit:
+            fields.append(compress_size)
+            compress_size = zip64_limit
+        if offset >= zip64_limit:
+            fields.append(offset)
+            offset = zip64_limit
+        extra = b""
+        version = 20
+        if fields:
+            extra = struct.pack(f"<HH{len(fields)}Q", 1, 8 * len(fields),
+                                *fields)
+            version = 45
+        mtime, mdate = self.dos_time()
+        return struct.pack(
+            "<IHHHHHHIIIHHHHHII",
+            0x02014B50,
+            (3 << 8) | version,  # made by unix
+            version,
+            self.flags(),
+            self.method,
+            mtime,
+            mdate,
+            self.crc,
+            compress_size,
+            size,
+            len(name),
+            len(extra),
+            0,
+            0,
+            0,
+            (stat.S_IMODE(self.mode) | stat.S_IFREG) << 16,
+            offset,
+        ) + name + extra
+
+    def copy_to(self, fp: IO[bytes]) -> None:
+        if self.source is not None:
+            base, offset = self.source
+            with open(base, "rb") as fin:
+                fin.seek(offset)
+                left = self.compress_size
+                while left:
+                    chunk = fin.read(min(left, chunk_size))
+                    if not chunk:
+                        raise OjpackerError(f"'{base}' is truncated")
+                    fp.write(chunk)
+                    left -= len(chunk)
+        elif self.data is not None:
+            shutil.copyfileobj(self.data, fp, chunk_size)
+            self.data.close()
+        else:
+            with open(self.path, "rb") as fin:
+                shutil.copyfileobj(fin, fp, chunk_size)
+
+
+class tar_member:
+    """
+    header, data and padding of a file in tar, compressed as a whole stream
+    """
+    def __init__(self, name: str, path: str, codec: str, level: int) -> None:
+        begin = time.perf_counter()
+        self.name = name
+        self.path = path
+        info = os.stat(path)
+        tarinfo = tarfile.TarInfo(name)
+        tarinfo.size = info.st_size
+        tarinfo.mtime = int(info.st_mtime)
+        tarinfo.mode = stat.S_IMODE(info.st_mode)
+        self.header = tarinfo.tobuf(tarfile.PAX_FORMAT, "utf-8",
+                                    "surrogateescape")
+        self.padding = b"\0" * (-info.st_size % tarfile.BLOCKSIZE)
+        self.size = info.st_size
+        self.tar_size = len(self.header) + self.size + len(self.padding)
+        self.data: Optional[IO[bytes]] = None
+        if codec:
+            self.compress(compressor(codec, level))
+        self.time = time.perf_counter() - begin
+
+    def compress(self, comp: Any) -> None:
+        self.data = tempfile.SpooledTemporaryFile(spool_size)
+        self.data.write(comp.compress(self.header))
+        with open(self.path, "rb") as fp:
+            for chunk in iter(lambda: fp.read(chunk_size), b""):
+                self.data.write(comp.compress(chunk))
+        self.data.write(comp.compress(self.padding))
+        self.data.write(comp.flush())
+        self.data.seek(0)
+
+    def copy_to(self, fp: IO[bytes]) -> None:
+        if self.data is not None:
+            shutil.copyfileobj(self.data, fp, chunk_size)
+            self.data.close()
+        else:
+            fp.write(self.header)
+            with open(self.path, "rb") as fin:
+                shutil.copyfileobj(fin, fp, chunk_size)
+            fp.write(self.padding)
+
+
+class writer(abc.ABC):
+    """
+    members are compressed in a pool of threads (zlib, lzma and zstandard
+    release the GIL) and written in the order they are added
+    """
+    def __init__(self,
+                 path: str,
+                 workers: int,
+                 tracer: trace.recorder = trace.off) -> None:
+        self.fp = open(path, "wb")
+        self.tracer = tracer
+        self.pool = ThreadPoolExecutor(max_workers=max(workers, 1))
+        # size before compression, and the time spent by the threads
+        self.raw_size = 0
+        self.busy = 0.0
+        # time anything was compressed or written, waiting for cases is not
+        self.wall = 0.0
+        self.active = 0
+        self.since = 0.0
+        self.lock = threading.Lock()
+
+    @abc.abstractmethod
+    def submit(self, name: str, path: str) -> "Future[Any]":
+        """
+        start compressing, the result is passed to write()
+        """
+
+    def write(self, item: Any) -> None:
+        self.raw_size += item.size
+        self.busy += item.time
+        self.enter()
+        try:
+            with self.tracer.span(item.name, "write", size=item.size):
+                item.copy_to(self.fp)
+        finally:
+            self.leave()
+
+    def build(self, factory: Any, name: str, *args: Any) -> Any:
+        """
+        run in the pool, a member made by factory(name, *args)
+        """
+        self.enter()
+        try:
+            with self.tracer.span(name, "compress"):
+                return factory(name, *args)
+        finally:
+            self.leave()
+
+    def enter(self) -> None:
+        with self.lock:
+            if not self.active:
+                self.since = time.perf_counter()
+            self.active += 1
+
+    def leave(self) -> None:
+        with self.lock:
+            self.active -= 1
+            if not self.active:
+                self.wall += time.perf_counter() - self.since
+
+    def close(self) -> None:
+        self.pool.shutdown()
+        self.fp.close()
+
+    def abort(self) -> None:
+        self.pool.shutdown()
+        self.fp.close()
+
+
+class zip_writer(writer):
+    """
+    a standard zip, zip64 only when needed.  
+    with `base`, an old zip, unchanged members are copied without compression
+    """
+    @log
+    def __init__(self,
+                 path: str,
+                 level: int = 6,
+                 workers: int = 1,
+                 base: str = "",
+                 tracer: trace.recorder = trace.off) -> None:
+        super().__init__(path, workers, tracer)
+        self.level = level
+        self.members: List[member] = []
+        self.base = base
+        self.index: Dict[str, zipfile.ZipInfo] = {}
+        self.reused = 0
+        if base:
+            with zipfile.ZipFile(base) as fp:
+                for info in fp.infolist():
+                    # encrypted or other methods can't be copied as is
+                    if info.compress_type in (ZIP_STORED, ZIP_DEFLATED) \
+                            and not info.flag_bits & 1:
+                        self.index[info.filename] = info
+
+    def submit(self, name: str, path: str) -> "Future[member]":
+        return self.pool.submit(self.build, member, name, path, self.level,
+                                self.index.get(name), self.base)
+
+    def write(self, item: member) -> None:
+        item.offset = self.fp.tell()
+        self.fp.write(item.local_header())
+        super().write(item)
+        self.members.append(item)
+        if item.source is not None:
+            self.reused += 1
+
+    @log
+    def close(self) -> None:
+        self.pool.shutdown()
+        offset = self.fp.tell()
+        for item in self.members:
+            self.fp.write(item.central_header())
+        size = self.fp.tell() - offset
+        count = len(self.members)
+        if count >= 0xFFFF or size >= zip64_limit or offset >= zip64_limit:
+            end64 = self.fp.tell()
+            self.fp.write(
+                struct.pack("<IQHHIIQQQQ", 0x06064B50, 44, 45, 45, 0, 0, count,
+                            count, size, offset))
+            self.fp.write(struct.pack("<IIQI", 0x07064B50, 0, end64, 1))
+            self.fp.write(
+                struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, 0xFFFF, 0xFFFF,
+                            zip64_limit, zip64_limit, 0))
+        else:
+            self.fp.write(
+                struct.pack("<IHHHHIIH", 0x06054B50, 0, 0, count, count, size,
+                            offset, 0))
+        self.fp.close()
+
+
+class tar_writer(writer):
+    """
+    a tar in pax format, every member is a compressed stream of its own
+    """
+    @log
+    def __init__(self,
+                 path: str,
+                 codec: str,
+                 level: int,
+                 workers: int = 1,
+                 tracer: trace.recorder = trace.off) -> None:
+        super().__init__(path, workers, tracer)
+        self.codec = codec
+        self.level = level
+        self.tar_size = 0
+
+    def submit(self, name: str, path: str) -> "Future[tar_member]":
+        return self.pool.submit(self.build, tar_member, name, path,
+                                self.codec, self.level)
+
+    def write(self, item: tar_member) -> None:
+        self.tar_size += item.tar_size
+        super().write(item)
+
+    @log
+    def close(self) -> None:
+        self.pool.shutdown()
+        # two zero blocks at the end, then padded to a whole record
+        end = 2 * tarfile.BLOCKSIZE
+        end += -(self.tar_size + end) % tarfile.RECORDSIZE
+        if self.codec:
+            comp = compressor(self.codec, self.level)
+            self.fp.write(comp.compress(b"\0" * end) + comp.flush())
+        else:
+            self.fp.write(b"\0" * end)
+        self.fp.close()
+
+
+@log
+def get_writer(format: str,
+               path: str,
+               level: Optional[int],
+               workers: int,
+               base: str = "",
+               tracer: trace.recorder = trace.off
+               ) -> Union[zip_writer, tar_writer]:
+    """
+    level None means the default of the codec.
+    base is an old archive to reuse, only for zip
+    """
+    codec = formats[format][1]
+    if level is None:
+        level = levels[codec][0]
+    if codec == "deflate":
+        return zip_writer(path, level, workers, base, tracer)
+    if codec == "store":
+        return zip_writer(path, 0, workers, base, tracer)
+    return tar_writer(path, codec, level, workers, tracer)
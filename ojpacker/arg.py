@@ -3,7 +3,7 @@ from __future__ import absolute_import
 import argparse
 from typing import Optional, Sequence, Text
 
-from . import config, demo, ui, workflow
+from . import config, stats, ui
 from .ui import log
 
 
@@ -61,12 +61,20 @@ def get_parser() -> argparse.ArgumentParser:
     )
     parser.add_argument(
         "-dir",
-        default="temp",
+        default="",
         type=str,
         help="the input directory when you skip making input",
         metavar="directory",
         dest="input_dir",
     )
+    parser.add_argument(
+        "-workspace",
+        default="",
+        type=str,
+        help="the directory to hold temporary data, such as /dev/shm",
+        metavar="directory",
+        dest="workspace",
+    )
     parser.add_argument(
         "-input",
         default="",
@@ -97,16 +105,125 @@ def get_parser() -> argparse.ArgumentParser:
         metavar="FILE",
         dest="zip_list",
     )
+    parser.add_argument(
+        "-update",
+        action="store_true",
+        help="update the existing zip, unchanged members are not compressed again",
+        dest="update_zip",
+    )
+    parser.add_argument(
+        "-yes",
+        action="store_true",
+        help="replace the existing archive without countdown",
+        dest="assume_yes",
+    )
+    parser.add_argument(
+        "-format",
+        default=None,
+        # checked by archive.check(), which is too heavy to import here
+        help="format of the archive: zip (default), store, tar, tar.gz, "
+        "tar.xz or tar.zst",
+        metavar="FORMAT",
+        dest="archive_format",
+    )
+    parser.add_argument(
+        "-ziplevel",
+        type=int,
+        default=None,
+        help="compression level, 0 means store only for zip",
+        metavar="LEVEL",
+        dest="zip_level",
+    )
     parser.add_argument(
         "-multiprocess",
         nargs='?',
         type=int,
         const=0,
         default=-1,
-        help="Use multiprocess when executing programs",
+        help="Use multiprocess when executing programs, automatic without Max",
         metavar="Max",
         dest="max_process",
     )
+    parser.add_argument(
+        "-pipeline",
+        action="store_true",
+        help="start making output of a case as soon as its input is made",
+        dest="pipeline",
+    )
+    parser.add_argument(
+        "-expand",
+        action="store_true",
+        help="expand ranges like {1..100} in state into many cases",
+        dest="state_expand",
+    )
+    parser.add_argument(
+        "-cache",
+        action="store_true",
+        help="reuse the data of unchanged cases from the local cache",
+        dest="cache",
+    )
+    parser.add_argument(
+        "-recompile",
+        action="store_false",
+        help="compile even if the source is in the compile cache",
+        dest="compile_cache",
+    )
+    parser.add_argument(
+        "-stats",
+        nargs='?',
+        const="wall",
+        default="",
+        choices=stats.sort_keys,
+        help="print the resource usage of cases, sorted by KEY (default wall)",
+        metavar="KEY",
+        dest="stats_sort",
+    )
+    parser.add_argument(
+        "-statsjson",
+        default="",
+        help="write the resource usage of cases to FILE in json",
+        metavar="FILE",
+        dest="stats_json",
+    )
+    parser.add_argument(
+        "-trace",
+        default="",
+        help="write a timeline of the run to FILE in Chrome trace format",
+        metavar="FILE",
+        dest="trace_file",
+    )
+    parser.add_argument(
+        "-timelimit",
+        default=0,
+        type=float,
+        help="wall time limit of each case in seconds",
+        metavar="SEC",
+        dest="time_limit",
+    )
+    parser.add_argument(
+        "-cpulimit",
+        default=0,
+        type=int,
+        help="cpu time limit of each case in seconds",
+        metavar="SEC",
+        dest="cpu_limit",
+    )
+    parser.add_argument(
+        "-memorylimit",
+        default=0,
+        type=int,
+        help="address space limit of each case in MB",
+        metavar="MB",
+        dest="memory_limit",
+    )
+    parser.add_argument(
+        "-outputlimit",
+        default=0,
+        type=int,
+        help="output file size limit of each case in MB",
+        metavar="MB",
+        dest="output_limit",
+    )
 
     # config
     config = sub.add_parser(
@@ -153,30 +270,51 @@ def analyze(argv: Optional[Sequence[Text]]) -> None:
     ans = parser.parse_args(argv)
     ui.set_log_level(ans.log_level)
     ui.detail("argv:", argv)
-    ans.func(ans)
+    # the default was taken before the level, look up its logger again
+    globals()[ans.func.__name__](ans)
 
 
 # call workflow
 @log
 def run_call(args: argparse.Namespace) -> None:
-    config.load_setting()
-    config.zip_name = args.name or config.zip_name
-    if args.input_exec_type:
-        config.set_input_exec(args.input_exec_type)
-    if args.output_exec_type:
-        config.set_output_exec(args.output_exec_type)
-    config.input_dir = args.input_dir
-    config.show_input = "input" in args.show
-    config.show_output = "output" in args.show
-    config.will_zip = args.zip
-    config.zip_list = args.zip_list
-    config.max_process = args.max_process
-    workflow.work()
+    from . import packer
+    run_config = config.RunConfig.load()
+    run_config.update(
+        input_exec=args.input_exec_type or "",
+        output_exec=args.output_exec_type or "",
+        time_limit=args.time_limit,
+        cpu_limit=args.cpu_limit,
+        memory_limit=args.memory_limit,
+        output_limit=args.output_limit,
+        input_dir=args.input_dir,
+        show_input="input" in args.show,
+        show_output="output" in args.show,
+        will_zip=args.zip,
+        zip_list=args.zip_list,
+        update_zip=args.update_zip,
+        assume_yes=args.assume_yes,
+        max_process=args.max_process,
+        pipeline=args.pipeline,
+        stats_sort=args.stats_sort,
+        stats_json=args.stats_json,
+        trace_file=args.trace_file,
+    )
+    run_config.zip_name = args.name or run_config.zip_name
+    run_config.workspace = args.workspace or run_config.workspace
+    run_config.archive_format = (args.archive_format
+                                 or run_config.archive_format)
+    if args.zip_level is not None:
+        run_config.zip_level = args.zip_level
+    run_config.state_expand = args.state_expand or run_config.state_expand
+    run_config.use_cache = args.cache or run_config.use_cache
+    run_config.compile_cache = args.compile_cache and run_config.compile_cache
+    packer.Packer(run_config).run()
 
 
 # call config
 @log
 def config_call(args: argparse.Namespace) -> None:
+    from . import demo
     if args.create_demo_config:
         demo.make_config()
     if args.config_copyto is not None:
@@ -186,4 +324,5 @@ def config_call(args: argparse.Namespace) -> None:
 # call demo
 @log
 def demo_call(args: argparse.Namespace) -> None:
+    from . import demo
     demo.make_demo(args.demo_dir)
@@ -0,0 +1,298 @@
+from __future__ import absolute_import
+
+import hashlib
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import tempfile
+from functools import lru_cache, partial
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+from . import filetype, ui
+from .ui import log
+
+if TYPE_CHECKING:
+    from .context import context
+
+try:
+    import fcntl
+except ImportError:  # not on unix
+    fcntl = None  # type: ignore
+
+# ioctl FICLONE on linux, make a copy-on-write clone of the whole file
+FICLONE = 0x40049409
+
+cache_dir = os.path.expanduser(os.path.join("~", ".cache", "ojpacker"))
+
+# the evicted parts of cache_dir, anything else (like timing) is kept
+evict_dirs = ["case", "compile"]
+# total size of evict_dirs when the last run ended, an upper bound
+usage_path = os.path.join(cache_dir, "usage")
+
+# the headers of a source that are part of the compile key
+include_pattern = re.compile(rb'^[ \t]*#[ \t]*include[ \t]*"([^"\n]+)"', re.M)
+
+
+def file_hash(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(partial(fp.read, 1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def exec_hash(ctx: "context", file: filetype.execfile) -> str:
+    """
+    identify the generator by its source and commands, once in a run
+    """
+    if file.src not in ctx.exec_hashes:
+        ctx.exec_hashes[file.src] = get_key(file_hash(ctx.path(file.src)),
+                                            file.compile_cmd,
+                                            file.execute_cmd)
+    return ctx.exec_hashes[file.src]
+
+
+def get_key(*parts: str) -> str:
+    return hashlib.sha256("\0".join(parts).encode()).hexdigest()
+
+
+def case_path(key: str) -> str:
+    return os.path.join(cache_dir, "case", key[:2], key)
+
+
+@lru_cache(maxsize=None)
+def compiler_version(cmd: str) -> str:
+    """
+    output of '{compiler} --version', empty if it can't be found
+    """
+    try:
+        compiler = shlex.split(cmd)[0]
+        return subprocess.run(
+            [compiler, "--version"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True,
+        ).stdout
+    except (IndexError, OSError):
+        return ""
+
+
+def local_includes(src: str) -> List[str]:
+    """
+    files of #include "..." in src and in them, found next to the including
+    file. system headers and the directories of -I are not followed
+    """
+    found: List[str] = []
+    todo = [src]
+    while todo:
+        path = todo.pop()
+        with open(path, "rb") as fp:
+            names = include_pattern.findall(fp.read())
+        for name in names:
+            dep = os.path.normpath(
+                os.path.join(os.path.dirname(path),
+                             name.decode(errors="replace")))
+            if dep != src and dep not in found and os.path.isfile(dep):
+                found.append(dep)
+                todo.append(dep)
+    return sorted(found)
+
+
+def compile_key(ctx: "context", file: filetype.execfile) -> str:
+    """
+    the source and its local headers, the command and the compiler
+    """
+    src = ctx.path(file.src)
+    command = file.get_compile()
+    headers = [
+        f"{os.path.relpath(dep, os.path.dirname(src))}:{file_hash(dep)}"
+        for dep in local_includes(src)
+    ]
+    return get_key(file_hash(src), command, compiler_version(command),
+                   *headers)
+
+
+def compile_path(key: str) -> str:
+    return os.path.join(cache_dir, "compile", key)
+
+
+def clone(src: str, dst: str, link: bool = True) -> None:
+    """
+    reflink if the filesystem supports, otherwise hardlink (if `link`), at last copy
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if fcntl is not None:
+        with open(src, "rb") as fin, open(dst, "wb") as fout:
+            try:
+                fcntl.ioctl(fout.fileno(), FICLONE, fin.fileno())
+                return
+            except OSError:
+                pass
+        os.remove(dst)
+    if link:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+
+
+@log
+def restore(ctx: "context", key: str, dst: str) -> bool:
+    """
+    put the cached file to dst, return whether it hits
+    """
+    path = case_path(key)
+    if not os.path.isfile(path):
+        ctx.cache_miss += 1
+        return False
+    # hardlinks are shared with the final directory when not zipped
+    clone(path, dst, link=ctx.config.will_zip)
+    os.utime(path)
+    ctx.cache_hit += 1
+    return True
+
+
+def temp_name(path: str) -> str:
+    """
+    a new file next to path, unique among the processes and threads
+    """
+    fd, tmp = tempfile.mkstemp(prefix=f"{os.path.basename(path)}.",
+                               suffix=".tmp",
+                               dir=os.path.dirname(path))
+    os.close(fd)
+    return tmp
+
+
+@log
+def store(ctx: "context", key: str, src: str) -> None:
+    """
+    the same key has the same content, the last replace wins
+    """
+    path = case_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = temp_name(path)
+    clone(src, tmp, link=ctx.config.will_zip)
+    os.replace(tmp, path)
+    add_stored(ctx, path)
+
+
+@log
+def restore_compile(key: str, exe: str) -> Optional[str]:
+    """
+    put the cached executable to exe, return the compile message or None
+    """
+    path = compile_path(key)
+    exe_cache = os.path.join(path, "exe")
+    message_cache = os.path.join(path, "message")
+    if not is_compiled(path):
+        return None
+    clone(exe_cache, exe)
+    shutil.copymode(exe_cache, exe)
+    os.utime(exe_cache)
+    os.utime(message_cache)
+    with open(message_cache, "r") as fp:
+        return fp.read()
+
+
+@log
+def store_compile(ctx: "context", key: str, exe: str, message: str) -> None:
+    """
+    if another run stores the same key first, its result is kept
+    """
+    path = compile_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=f"{key}.", suffix=".tmp",
+                           dir=os.path.dirname(path))
+    try:
+        clone(exe, os.path.join(tmp, "exe"), link=False)
+        shutil.copymode(exe, os.path.join(tmp, "exe"))
+        with open(os.path.join(tmp, "message"), "w") as fp:
+            fp.write(message)
+        if is_compiled(path):
+            return
+        # left incomplete by evict, which removes files one by one
+        shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            if is_compiled(path):  # stored by another run in between
+                return
+            raise
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    add_stored(ctx, os.path.join(path, "exe"), os.path.join(path, "message"))
+
+
+def is_compiled(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, "exe")) and os.path.isfile(
+        os.path.join(path, "message"))
+
+
+def add_stored(ctx: "context", *paths: str) -> None:
+    ctx.cache_stored += sum(os.path.getsize(path) for path in paths)
+
+
+def read_usage() -> Optional[int]:
+    try:
+        with open(usage_path, "r") as fp:
+            return int(fp.read())
+    except (OSError, ValueError):
+        return None
+
+
+def write_usage(usage: int) -> None:
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = temp_name(usage_path)
+    with open(tmp, "w") as fp:
+        fp.write(str(usage))
+    os.replace(tmp, usage_path)
+
+
+@log
+def evict(ctx: "context") -> None:
+    """
+    remove the least recently used files until the cache fits cache_size (MB).
+    the cache is only walked when the size of the last walk, plus what this
+    run stored, may exceed the limit
+    """
+    limit = ctx.config.cache_size * 1024 * 1024
+    usage = read_usage()
+    stored, ctx.cache_stored = ctx.cache_stored, 0
+    if usage is not None and usage + stored <= limit:
+        ui.detail(f"cache: at most {usage + stored} bytes")
+        write_usage(usage + stored)
+        return
+    entries: List[Tuple[float, int, str]] = []
+    total = 0
+    for part in evict_dirs:
+        for root, _, files in os.walk(os.path.join(cache_dir, part)):
+            for name in files:
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+    ui.detail(f"cache: {len(entries)} file(s), {total} bytes")
+    if total <= limit:
+        write_usage(total)
+        return
+    entries.sort()
+    removed = 0
+    for _, size, path in entries:
+        if total <= limit:
+            break
+        os.remove(path)
+        total -= size
+        removed += 1
+    write_usage(total)
+    ui.info(f"cache: {removed} least recently used file(s) evicted")
+
+
+@log
+def report(ctx: "context") -> None:
+    if ctx.cache_hit + ctx.cache_miss:
+        ui.info(f"case cache: {ctx.cache_hit} hit, {ctx.cache_miss} miss")
@@ -9,27 +9,7 @@ from . import filetype, ui
 from .error import OjpackerError
 from .ui import log
 
-# config
-## from json
-zip_name: str = ""
-state_name: str = ""
-input_data_name: str = ""
-output_data_name: str = ""
-input_exec: Optional[filetype.execfile] = None
-output_exec: Optional[filetype.execfile] = None
-input_default_exec: str = ""
-output_default_exec: str = ""
-input_exec_map: Dict[str, Dict[str, str]] = {}
-output_exec_map: Dict[str, Dict[str, str]] = {}
-## from arg
-input_dir: str = "temp"
-show_input: bool = False
-show_output: bool = False
-will_zip: bool = True
-zip_list: List[str] = []
-max_process: int = -1
-
-# List[src, dst]
+# json key -> name in RunConfig
 config_map: Dict[str, str] = {
     "defalut_zip_name": "zip_name",
     "state_name": "state_name",
@@ -39,6 +19,14 @@ config_map: Dict[str, str] = {
     "output_default_exec": "output_default_exec",
     "input_exec": "input_exec_map",
     "output_exec": "output_exec_map",
+    "cache": "use_cache",
+    "cache_size": "cache_size",
+    "compile_cache": "compile_cache",
+    "timing": "use_timing",
+    "workspace": "workspace",
+    "state_expand": "state_expand",
+    "archive_format": "archive_format",
+    "zip_level": "zip_level",
 }
 
 # file part
@@ -46,23 +34,128 @@ json_name = "ojpacker.json"
 user_setting = os.path.expanduser(os.path.join("~", ".config", json_name))
 
 
-def load_setting(path: Optional[str] = None) -> None:
+class RunConfig:
+    """
+    settings of a run, from json (see config_map) and arg.
+    root is the directory of the problem, paths in settings are relative to it
+    """
+    def __init__(self, root: str = ".", **settings: Any) -> None:
+        self.root = root
+        ## from json
+        self.zip_name = ""
+        self.state_name = ""
+        self.input_data_name = ""
+        self.output_data_name = ""
+        self.input_default_exec = ""
+        self.output_default_exec = ""
+        self.input_exec_map: Dict[str, Dict[str, Any]] = {}
+        self.output_exec_map: Dict[str, Dict[str, Any]] = {}
+        self.use_cache = False
+        self.cache_size = 1024  # MB
+        self.compile_cache = True
+        self.use_timing = True
+        self.workspace = ""
+        self.state_expand = False
+        self.archive_format = "zip"
+        # None means the default of the format
+        self.zip_level: Optional[int] = None
+        ## from arg
+        # names in input_exec_map / output_exec_map, "" means the default
+        self.input_exec = ""
+        self.output_exec = ""
+        # limits of every case, 0 keeps the ones of execfile
+        self.time_limit = 0.0
+        self.cpu_limit = 0
+        self.memory_limit = 0
+        self.output_limit = 0
+        self.input_dir = ""
+        self.show_input = False
+        self.show_output = False
+        self.will_zip = True
+        self.zip_list: List[str] = []
+        self.update_zip = False
+        self.assume_yes = False
+        self.max_process = -1
+        self.pipeline = False
+        self.stats_sort = ""
+        self.stats_json = ""
+        self.trace_file = ""
+        self.update(**settings)
+
+    @classmethod
+    def load(cls,
+             root: str = ".",
+             path: Optional[str] = None,
+             **settings: Any) -> "RunConfig":
+        """
+        settings from the json (the local one in root, or the user one),
+        then the keyword arguments
+        """
+        run_config = cls(root, **read_setting(path, root))
+        run_config.update(**settings)
+        return run_config
+
+    def update(self, **settings: Any) -> None:
+        for name, value in settings.items():
+            if not hasattr(self, name):
+                raise OjpackerError(f"unknown setting '{name}'")
+            setattr(self, name, value)
+
+    @log
+    def get_input_exec(self) -> Optional[filetype.execfile]:
+        return self._get_exec(self.input_exec_map, self.input_exec
+                              or self.input_default_exec)
+
+    @log
+    def get_output_exec(self) -> Optional[filetype.execfile]:
+        return self._get_exec(self.output_exec_map, self.output_exec
+                              or self.output_default_exec)
+
+    def _get_exec(self, exec_map: Dict[str, Dict[str, Any]],
+                  name: str) -> Optional[filetype.execfile]:
+        """
+        a new execfile with the limits of this run, None if not in map
+        """
+        if name not in exec_map:
+            return None
+        file = filetype.get_execfile(exec_map[name])
+        file.set_limits(
+            time_limit=self.time_limit,
+            cpu_limit=self.cpu_limit,
+            memory_limit=self.memory_limit,
+            output_limit=self.output_limit,
+        )
+        return file
+
+
+def find_setting(root: str = ".") -> str:
+    """
+    the local config in root, otherwise the user config
+    """
+    local = os.path.join(root, json_name)
+    if os.path.isfile(local):
+        if os.path.isfile(user_setting):
+            ui.info("use local config")
+        else:
+            ui.detail("use local config")
+        return local
+    if os.path.isfile(user_setting):
+        ui.detail("use user config")
+        return user_setting
+    raise OjpackerError("No user or local configuration found")
+
+
+def read_setting(path: Optional[str] = None,
+                 root: str = ".") -> Dict[str, Any]:
+    """
+    settings in json, by the names in RunConfig
+    """
     if path:
         if not os.path.isfile(path):
             raise OjpackerError(f"can't find file at {path}")
         setting_json = path
     else:
-        if os.path.isfile(json_name):
-            setting_json = json_name
-            if os.path.isfile(user_setting):
-                ui.info("use local config")
-            else:
-                ui.detail("use local config")
-        elif os.path.isfile(user_setting):
-            setting_json = user_setting
-            ui.detail("use user config")
-        else:
-            raise OjpackerError("No user or local configuration found")
+        setting_json = find_setting(root)
 
     with open(setting_json, "r") as fp:
         try:
@@ -70,34 +163,15 @@ def load_setting(path: Optional[str] = None) -> None:
         except json.JSONDecodeError:
             raise OjpackerError("wrong json format")
 
-    if isinstance(file_setting, dict):
-        for name in config_map:
-            if name in file_setting:
-                globals()[config_map[name]] = file_setting.get(name)
-            else:
-                ui.detail(f"'{name}' not in json")
-        set_input_exec(input_default_exec)
-        set_output_exec(output_default_exec)
-    else:
+    if not isinstance(file_setting, dict):
         raise OjpackerError("wrong json format")
-
-
-@log
-def set_input_exec(name: str) -> None:
-    global input_exec
-    if name in input_exec_map:
-        input_exec = filetype.get_execfile(input_exec_map[name])
-    else:
-        input_exec = None
-
-
-@log
-def set_output_exec(name: str) -> None:
-    global output_exec
-    if name in output_exec_map:
-        output_exec = filetype.get_execfile(output_exec_map[name])
-    else:
-        output_exec = None
+    setting = {}
+    for name in config_map:
+        if name in file_setting:
+            setting[config_map[name]] = file_setting.get(name)
+        else:
+            ui.detail(f"'{name}' not in json")
+    return setting
 
 
 @log
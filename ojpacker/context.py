@@ -0,0 +1,68 @@
+from __future__ import absolute_import
+
+import copy
+import os
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from . import config, filetype, stats, timing, trace
+from .ui import log
+
+if TYPE_CHECKING:
+    from .work_zip import stream
+    from .zygote import zygote
+
+
+class context:
+    """
+    a run: its settings and the state of it, passed to every stage,
+    so runs in the same process don't share anything.
+    the files in settings are relative to root, find them by path()
+    """
+    @log
+    def __init__(self, run_config: config.RunConfig) -> None:
+        # a copy, the stages may change it
+        self.config = copy.deepcopy(run_config)
+        self.root = os.path.abspath(self.config.root)
+        self.input_exec = self.config.get_input_exec()
+        self.output_exec = self.config.get_output_exec()
+        # temporary directory of this run, absolute
+        self.temp_dir = ""
+        # files in temp to remove after the phases, see garbage
+        self.garbage: List[str] = []
+        # resource usage of the processes, see stats
+        self.records: List[stats.record] = []
+        # cases restored from and stored into the cache, with their bytes
+        self.cache_hit = 0
+        self.cache_miss = 0
+        self.cache_stored = 0
+        # src -> hash of execfile, see cache.exec_hash
+        self.exec_hashes: Dict[str, str] = {}
+        self.timing = timing.history(self.config.use_timing)
+        self.tracer = trace.recorder(bool(self.config.trace_file))
+        # the archive written while running, see work_zip
+        self.writer: Optional["stream"] = None
+        # one zygote for each generator
+        self.zygotes: Dict[str, "zygote"] = {}
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def exe_dir(self) -> str:
+        """
+        temp as the commands see it, they run in root
+        """
+        try:
+            return os.path.relpath(self.temp_dir, self.root)
+        except ValueError:  # on another drive
+            return self.temp_dir
+
+    def input_data(self, path: str = "") -> filetype.data_file:
+        """
+        input files in path, temp by default
+        """
+        return filetype.data_file(self.config.input_data_name, path
+                                  or self.temp_dir, self.config.zip_name)
+
+    def output_data(self) -> filetype.data_file:
+        return filetype.data_file(self.config.output_data_name, self.temp_dir,
+                                  self.config.zip_name)
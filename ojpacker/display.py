@@ -0,0 +1,137 @@
+from __future__ import absolute_import
+
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from rich.progress import BarColumn, Progress, ProgressColumn, TaskID
+from rich.text import Text
+
+from . import scheduler, ui
+
+# a terminal shows one live display, the other runs print plain lines
+_live = threading.Lock()
+
+
+class board:
+    """
+    aggregated progress of a scheduler: the numbers of jobs, the throughput,
+    the ETA and the jobs running for the longest time.
+    rendered at most `refresh` times a second on a terminal,
+    otherwise (or when another run has the terminal)
+    a plain line every `interval` seconds by a timer, even if no job changes
+    """
+    refresh = 4
+    interval = 5.0
+    shown = 3
+
+    def __init__(self, runner: scheduler.scheduler) -> None:
+        self.runner = runner
+        self.begin = time.time()
+        self.done = 0
+        self.output = 0
+        # name -> start time, of the running jobs
+        self.started: Dict[str, float] = {}
+        self.progress: Optional[Progress] = None
+        self.task = TaskID(0)
+        # the timer of plain lines
+        self.stopped = threading.Event()
+        self.timer: Optional[threading.Thread] = None
+
+    def __enter__(self) -> "board":
+        if ui.console.is_terminal and _live.acquire(blocking=False):
+            self.progress = Progress(
+                " " * 15,
+                BarColumn(bar_width=20),
+                "{task.completed} of {task.total}",
+                _board_column(self),
+                console=ui.get_console(),
+                refresh_per_second=self.refresh,
+            )
+            self.progress.__enter__()
+            self.task = self.progress.add_task("", total=self.runner.total)
+        else:
+            self.timer = threading.Thread(target=self.repeat, daemon=True)
+            self.timer.start()
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        if self.progress is not None:
+            try:
+                self.progress.__exit__(*args)
+            finally:
+                _live.release()
+            return
+        self.stopped.set()
+        if self.timer is not None:
+            self.timer.join()
+        if args[0] is None:
+            ui.info(self.summary())
+
+    def on_start(self, name: str, job: Any) -> None:
+        ui.detail(f"subprocess {name} start")
+        self.started[name] = job.start_time
+        if self.progress is not None:
+            self.progress.update(self.task, total=self.runner.total)
+
+    def on_done(self, name: str, job: Any) -> None:
+        ui.detail(f"subprocess {name} done")
+        self.started.pop(name, None)
+        self.done += 1
+        self.output += job.output_size
+        if self.progress is not None:
+            self.progress.update(self.task, completed=self.done)
+
+    def repeat(self) -> None:
+        """
+        in the thread of timer
+        """
+        while not self.stopped.wait(self.interval):
+            ui.info(f"{self.done} of {self.runner.total}, {self.summary()}")
+
+    def summary(self) -> str:
+        return ", ".join(self.counts() + self.speed())
+
+    def counts(self) -> List[str]:
+        queued = f"{len(self.runner.queue)}"
+        if self.runner.sources:
+            queued += "+"
+        parts = [f"{len(self.runner.running)} running", f"{queued} queued"]
+        eta = self.runner.eta()
+        if eta is not None and self.runner.running:
+            parts.append(f"ETA {ui.readable_time(eta)}")
+        return parts
+
+    def speed(self) -> List[str]:
+        elapsed = max(time.time() - self.begin, 1e-6)
+        return [
+            f"{self.done / elapsed:.1f} case/s",
+            f"{ui.readable_byte(self.output / elapsed)}/s",
+        ]
+
+    def slowest(self) -> List[str]:
+        now = time.time()
+        started = dict(self.started)  # jobs start and finish meanwhile
+        names = sorted(started, key=started.__getitem__)
+        return [
+            f"{name} {now - started[name]:.1f}s" for name in names[:self.shown]
+        ]
+
+
+class _board_column(ProgressColumn):
+    """
+    computed when rendered, so the running time is always fresh
+    """
+    def __init__(self, owner: board) -> None:
+        super().__init__()
+        self.owner = owner
+
+    def render(self, task: Any) -> Text:
+        lines = [
+            ", ".join(self.owner.counts()),
+            ", ".join(self.owner.speed()),
+        ]
+        slowest = self.owner.slowest()
+        if slowest:
+            lines.append(", ".join(slowest))
+        return Text("\n".join(lines))
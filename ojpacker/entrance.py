@@ -3,7 +3,7 @@ from __future__ import absolute_import
 import shlex
 from typing import Sequence, Text, Union
 
-from . import arg, ui
+from . import ui
 from .error import OjpackerError
 
 
@@ -12,6 +12,7 @@ def start(argv: Union[Sequence[Text], Text, None] = None) -> None:
     main function, try to catch expected error
     """
     try:
+        from . import arg
         if isinstance(argv, Text):
             argv = shlex.split(argv)
         arg.analyze(argv)
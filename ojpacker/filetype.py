@@ -1,9 +1,11 @@
 from __future__ import absolute_import
 
+import itertools
 import os
-from typing import Dict
+import re
+import string
+from typing import Any, Dict, Iterator, List, Optional, Pattern, Tuple
 
-from . import config, ui
 from .error import OjpackerError
 from .ui import log
 
@@ -11,18 +13,38 @@ from .ui import log
 class execfile:
     """
     a class save the description of the execute file.  
-    you can you macro {src} {exe} in "command" 
+    you can you macro {src} {exe} in "command"  
+    limits of each execution, 0 means no limit: 
+    time_limit (wall, seconds), cpu_limit (seconds), memory_limit (MB), output_limit (MB)  
+    batch is the number of workers using the batch protocol, 0 means one process per case  
+    zygote forks python generators from a warm process, with modules in preload imported
     """
     @log
     def __init__(self,
                  src: str = "",
                  exe: str = "",
                  compile_cmd: str = "",
-                 execute_cmd: str = ""):
+                 execute_cmd: str = "",
+                 time_limit: float = 0,
+                 cpu_limit: int = 0,
+                 memory_limit: int = 0,
+                 output_limit: int = 0,
+                 batch: int = 0,
+                 batch_delimiter: str = "==ojpacker==",
+                 zygote: bool = False,
+                 preload: Optional[List[str]] = None):
         self.src = src
         self.exe = exe or src
         self.compile_cmd = compile_cmd
         self.execute_cmd = execute_cmd
+        self.time_limit = time_limit
+        self.cpu_limit = cpu_limit
+        self.memory_limit = memory_limit
+        self.output_limit = output_limit
+        self.batch = batch
+        self.batch_delimiter = batch_delimiter
+        self.zygote = zygote
+        self.preload = preload or []
 
     def get_compile(self, src_dir: str = "", exe_dir: str = "") -> str:
         return self.compile_cmd.format(src=os.path.join(src_dir, self.src),
@@ -32,48 +54,163 @@ class execfile:
         return self.execute_cmd.format(src=os.path.join(src_dir, self.src),
                                        exe=os.path.join(exe_dir, self.exe))
 
-
-def get_execfile(dic: Dict[str, str]) -> execfile:
+    def set_limits(self,
+                   time_limit: float = 0,
+                   cpu_limit: int = 0,
+                   memory_limit: int = 0,
+                   output_limit: int = 0) -> None:
+        """
+        override the limits which are not 0
+        """
+        self.time_limit = time_limit or self.time_limit
+        self.cpu_limit = cpu_limit or self.cpu_limit
+        self.memory_limit = memory_limit or self.memory_limit
+        self.output_limit = output_limit or self.output_limit
+
+    def limits(self) -> Dict[str, Any]:
+        """
+        keyword arguments of utiliy.popen
+        """
+        return {
+            "max_time": self.time_limit or None,
+            "max_cpu": self.cpu_limit or None,
+            "max_memory": self.memory_limit * 1024 * 1024 or None,
+            "max_output": self.output_limit * 1024 * 1024 or None,
+        }
+
+
+def get_execfile(dic: Dict[str, Any]) -> execfile:
     return execfile(
         src=dic.get("src", ""),
         exe=dic.get("exe", ""),
         compile_cmd=dic.get("compile_cmd", ""),
         execute_cmd=dic.get("execute_cmd", ""),
+        time_limit=dic.get("time_limit", 0),
+        cpu_limit=dic.get("cpu_limit", 0),
+        memory_limit=dic.get("memory_limit", 0),
+        output_limit=dic.get("output_limit", 0),
+        batch=dic.get("batch", 0),
+        batch_delimiter=dic.get("batch_delimiter", "==ojpacker=="),
+        zygote=dic.get("zygote", False),
+        preload=dic.get("preload", []),
     )
 
 
 class state_file():
+    """
+    lines of state, read lazily while iterating.  
+    with `expand`, every range {a..b} or {a..b..step} in a line
+    makes a case for each value (all combinations of several ranges)
+    """
     @log
-    def __init__(self, name: str) -> None:
-        with open(name, "r") as state_file:
-            self.lines = tuple(
-                map(
-                    lambda line: line.rstrip('\n'),
-                    state_file.readlines(),
-                ))
-        if len(self.lines) != 0:
-            ui.info(f"{len(self.lines)} line(s) in state")
-        else:
+    def __init__(self, name: str, expand: bool = False) -> None:
+        if os.path.getsize(name) == 0:
             raise OjpackerError("state file is empty")
+        self.name = name
+        self.expand = expand
+        self.count = 0
 
     def __len__(self) -> int:
-        return len(self.lines)
+        """
+        number of cases read so far, all of them after iterating
+        """
+        return self.count
 
-    def __getitem__(self, index: int) -> str:
-        return self.lines[index]
+    def __iter__(self) -> Iterator[str]:
+        self.count = 0
+        with open(self.name, "r") as fp:
+            for line in fp:
+                line = line.rstrip("\n")
+                for case in expand_line(line) if self.expand else (line, ):
+                    self.count += 1
+                    yield case
+
+
+range_pattern = re.compile(r"\{(-?\d+)\.\.(-?\d+)(?:\.\.(\d+))?\}")
+
+
+def expand_line(line: str) -> Iterator[str]:
+    """
+    "{1..3} x" -> "1 x", "2 x", "3 x", lazily
+    """
+    parts = range_pattern.split(line)
+    if len(parts) == 1:
+        yield line
+        return
+    texts = parts[::4]
+    ranges = []
+    for begin, end, step in zip(parts[1::4], parts[2::4], parts[3::4]):
+        step = int(step or 1)
+        if step == 0:
+            raise OjpackerError(f"step of range in state can't be 0: {line}")
+        if int(begin) <= int(end):
+            ranges.append(range(int(begin), int(end) + 1, step))
+        else:
+            ranges.append(range(int(begin), int(end) - 1, -step))
+    for values in itertools.product(*ranges):
+        yield "".join(
+            text + str(value)
+            for text, value in zip(texts, values)) + texts[-1]
 
 
 class data_file():
+    """
+    names of the cases in path, {num} is the number of case,
+    {name} is the name of the archive
+    """
     @log
-    def __init__(self, origin: str, path: str = "temp") -> None:
+    def __init__(self, origin: str, path: str, name: str = "") -> None:
         self.origin = origin
         self.path = path
+        self.name = name
 
     def __getitem__(self, index: int) -> str:
         return self.origin.format(
             num=index + 1,
-            name=config.zip_name,
+            name=self.name,
         )
 
     def with_path(self, index: int) -> str:
         return os.path.join(self.path, self[index])
+
+    def pattern(self) -> Pattern[str]:
+        """
+        regex of the names, the group num is the number of case
+        """
+        regex = ""
+        group = False
+        for text, field, spec, _ in string.Formatter().parse(self.origin):
+            regex += re.escape(text)
+            if field == "num":
+                # only the first one is a group, the others are the same
+                regex += r"\d+" if group else r"(?P<num>\d+)"
+                group = True
+            elif field == "name":
+                regex += re.escape(format(self.name, spec or ""))
+            elif field is not None:
+                raise OjpackerError(
+                    f"unknown macro {{{field}}} in '{self.origin}'")
+        return re.compile(regex)
+
+    @log
+    def scan(self) -> Tuple[List[int], List[str]]:
+        """
+        one pass over the directory,
+        return the sorted indexes of cases and the names that don't match
+        """
+        pattern = self.pattern()
+        indexes: List[int] = []
+        unmatched: List[str] = []
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                match = pattern.fullmatch(entry.name)
+                if match and "num" in pattern.groupindex and entry.is_file():
+                    index = int(match.group("num")) - 1
+                    # the name is formatted back, data01.in is not data1.in
+                    if index >= 0 and self[index] == entry.name:
+                        indexes.append(index)
+                        continue
+                unmatched.append(entry.name)
+        indexes.sort()
+        unmatched.sort()
+        return indexes, unmatched
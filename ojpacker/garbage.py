@@ -2,33 +2,36 @@ from __future__ import absolute_import
 
 import os
 import shutil
-from typing import List
+from typing import TYPE_CHECKING
 
 from . import ui
 from .ui import log
 
-files: List[str] = []
+if TYPE_CHECKING:
+    from .context import context
 
 
 @log
-def add(*arg: str) -> None:
+def add(ctx: "context", *arg: str) -> None:
     """
     everything should in temporary directory
     """
     for file_name in arg:
-        files.append(file_name)
+        ctx.garbage.append(file_name)
 
 
 @log
-def clean(clean_dir: bool = False) -> None:
+def clean(ctx: "context", clean_dir: bool = False) -> None:
     if clean_dir:
-        shutil.rmtree("temp")
-        files.clear()
+        # temp has been moved when not zipped
+        if os.path.isdir(ctx.temp_dir):
+            shutil.rmtree(ctx.temp_dir)
+        ctx.garbage.clear()
     else:
-        ui.detail("garbage:", *files)
-        for file_name in files:
+        ui.detail("garbage:", *ctx.garbage)
+        for file_name in ctx.garbage:
             if not os.path.isfile(file_name):
                 ui.warning(f"garbage '{file_name}' not found")
                 continue
             os.remove(file_name)
-        files.clear()
+        ctx.garbage.clear()
@@ -0,0 +1,41 @@
+from __future__ import absolute_import
+
+import time
+from typing import Any, List
+
+from .config import RunConfig
+from .ui import log
+
+
+class PackResult:
+    """
+    archive is the absolute path of the archive, or the directory if not
+    zipped. cases are stats.record of every process run, with the timings
+    """
+    def __init__(self, archive: str, cases: List[Any],
+                 elapsed: float) -> None:
+        self.archive = archive
+        self.cases = cases
+        self.elapsed = elapsed
+
+
+class Packer:
+    """
+    pack a problem in this process, any number of times.
+    every run has a context of its own and never changes the cwd,
+    so runs in different threads go at the same time
+    """
+    def __init__(self, run_config: RunConfig) -> None:
+        self.run_config = run_config
+
+    @log
+    def run(self) -> PackResult:
+        from . import context, work_zip, workflow
+        ctx = context.context(self.run_config)
+        begin = time.time()
+        workflow.work(ctx)
+        if ctx.config.will_zip:
+            archive = work_zip.archive_path(ctx)
+        else:
+            archive = ctx.path(ctx.config.zip_name)
+        return PackResult(archive, ctx.records, time.time() - begin)
@@ -0,0 +1,406 @@
+from __future__ import absolute_import
+
+import heapq
+import os
+import select
+import selectors
+import signal
+import threading
+import time
+from collections import deque
+from typing import (Any, Callable, Deque, Dict, Iterator, List, Optional,
+                    Tuple)
+
+from . import timing, trace, ui
+from .error import OjpackerError
+from .ui import log
+
+Callback = Optional[Callable[[], None]]
+
+
+class _pidfd_waiter:
+    """
+    a pidfd becomes readable as soon as its process exits,
+    so every wake up only returns the jobs that have really finished.  
+    a job with fileno() (not a child of ours) is waited through it instead
+    """
+    def __init__(self) -> None:
+        self.selector = selectors.DefaultSelector()
+        # job -> (fd, whether the fd is opened by us)
+        self.fds: Dict[Any, Tuple[int, bool]] = {}
+
+    def register(self, job: Any) -> None:
+        if hasattr(job, "fileno"):
+            fd, own = job.fileno(), False
+        else:
+            fd, own = os.pidfd_open(job.pid), True
+        self.fds[job] = (fd, own)
+        self.selector.register(fd, selectors.EVENT_READ, job)
+
+    def unregister(self, job: Any) -> None:
+        fd, own = self.fds.pop(job)
+        self.selector.unregister(fd)
+        if own:
+            os.close(fd)
+
+    def wait(self, timeout: Optional[float]) -> List[Any]:
+        return [key.data for key, _ in self.selector.select(timeout)]
+
+    def close(self) -> None:
+        for fd, own in self.fds.values():
+            if own:
+                os.close(fd)
+        self.fds.clear()
+        self.selector.close()
+
+
+class _signal_waiter:
+    """
+    SIGCHLD wakes up the select through the wakeup fd.
+    only usable in the main thread, returns every running job as candidate
+    """
+    def __init__(self) -> None:
+        self.running: Dict[Any, None] = {}
+        self.rfd, self.wfd = os.pipe()
+        os.set_blocking(self.rfd, False)
+        os.set_blocking(self.wfd, False)
+        self.old_fd = signal.set_wakeup_fd(self.wfd)
+        self.old_handler = signal.signal(signal.SIGCHLD, lambda *args: None)
+
+    def register(self, job: Any) -> None:
+        self.running[job] = None
+
+    def unregister(self, job: Any) -> None:
+        del self.running[job]
+
+    def wait(self, timeout: Optional[float]) -> List[Any]:
+        # jobs with fileno() are not our children, no SIGCHLD for them
+        fds = [job.fileno() for job in self.running if hasattr(job, "fileno")]
+        select.select([self.rfd] + fds, [], [], timeout)
+        try:
+            while os.read(self.rfd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        return list(self.running)
+
+    def close(self) -> None:
+        signal.signal(signal.SIGCHLD, self.old_handler)
+        signal.set_wakeup_fd(self.old_fd)
+        os.close(self.rfd)
+        os.close(self.wfd)
+
+
+class _poll_waiter(_signal_waiter):
+    """
+    last resort, when neither pidfd nor signal is available
+    """
+    interval = 0.01
+
+    def __init__(self) -> None:
+        self.running = {}
+
+    def wait(self, timeout: Optional[float]) -> List[Any]:
+        time.sleep(self.interval if timeout is None else min(
+            timeout, self.interval))
+        return list(self.running)
+
+    def close(self) -> None:
+        pass
+
+
+def _get_waiter() -> Any:
+    if hasattr(os, "pidfd_open"):
+        try:
+            os.close(os.pidfd_open(os.getpid()))
+            return _pidfd_waiter()
+        except OSError:
+            pass
+    if hasattr(signal, "SIGCHLD") and \
+            threading.current_thread() is threading.main_thread():
+        return _signal_waiter()
+    return _poll_waiter()
+
+
+def cpu_count() -> int:
+    """
+    number of cpus this process may run on
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def runnable() -> float:
+    """
+    number of other runnable tasks right now, 1 minute load if unknown
+    """
+    try:
+        with open("/proc/loadavg", "r") as fp:
+            # the 4th field is "runnable/total", including this process
+            return int(fp.read().split()[3].split("/")[0]) - 1
+    except (OSError, IndexError, ValueError):
+        return os.getloadavg()[0]
+
+
+def memory_low(ratio: float) -> bool:
+    """
+    whether the available memory is lower than `ratio` of total
+    """
+    info: Dict[str, int] = {}
+    try:
+        with open("/proc/meminfo", "r") as fp:
+            for line in fp:
+                name, value = line.split(":", 1)
+                info[name] = int(value.split()[0])
+    except (OSError, ValueError):
+        return False
+    if "MemAvailable" not in info or "MemTotal" not in info:
+        return False
+    return info["MemAvailable"] < info["MemTotal"] * ratio
+
+
+class admission:
+    """
+    decide whether a new job can start when the concurrency is automatic.  
+    the target starts at the number of cpus and is adjusted every interval:
+    raised while cpus are idle, so I/O bound jobs may exceed the number of cpus
+    (up to twice), lowered when the cpus are overloaded, including by other
+    programs, or the available memory is low
+    """
+    interval = 0.05  # seconds between two samples
+    memory_ratio = 0.1
+
+    @log
+    def __init__(self) -> None:
+        self.cpus = cpu_count()
+        self.limit = self.cpus * 2
+        self.target = self.cpus
+        self.last = 0.0
+        ui.detail(f"automatic concurrency, {self.cpus} cpu(s)")
+
+    def allow(self, running: int) -> bool:
+        now = time.time()
+        if now - self.last >= self.interval:
+            self.last = now
+            load = runnable()
+            if memory_low(self.memory_ratio) or load > self.cpus:
+                self.target = max(self.target - 1, 1)
+            elif load < self.cpus:
+                self.target = min(self.target + 1, self.limit)
+        return running < self.target
+
+
+# (job, name, on_done, timing key, expected seconds)
+Item = Tuple[Any, str, Callback, str, Optional[float]]
+
+
+class job_queue:
+    """
+    jobs added with `first` come out in order before the others,
+    the others come out longest expected first (LPT), then in order
+    """
+    def __init__(self) -> None:
+        self.urgent: Deque[Item] = deque()
+        self.heap: List[Tuple[float, int, Item]] = []
+        self.count = 0
+
+    def __len__(self) -> int:
+        return len(self.urgent) + len(self.heap)
+
+    def push(self, item: Item, first: bool = False) -> None:
+        if first:
+            self.urgent.append(item)
+        else:
+            self.count += 1
+            heapq.heappush(self.heap, (-(item[4] or 0), self.count, item))
+
+    def pop(self) -> Item:
+        if self.urgent:
+            return self.urgent.popleft()
+        return heapq.heappop(self.heap)[2]
+
+    def items(self) -> List[Item]:
+        """
+        a copy, taken at once so the thread of display can read it
+        """
+        return list(self.urgent) + [item for _, _, item in list(self.heap)]
+
+
+class scheduler:
+    """
+    run jobs with at most `max_process` of them at the same time.
+    -1 means one by one, 0 means automatic (see admission).
+    a job needs start() / check() / halt(), the attribute pid and max_time.
+    the next job is started as soon as a running one exits,
+    callbacks may add() new jobs while running.  
+    jobs may also come from feed(), which is read ahead by `window` jobs,
+    the jobs expected to be the longest by the timing history start first
+    """
+    window = 256
+
+    @log
+    def __init__(self,
+                 max_process: int = -1,
+                 history: Optional[timing.history] = None,
+                 tracer: trace.recorder = trace.off) -> None:
+        self.max_process = max_process
+        # timing history of the run, none is kept by default
+        self.history = history or timing.history(False)
+        self.tracer = tracer
+        self.queue = job_queue()
+        self.running: Dict[Any, Item] = {}
+        # seconds of the jobs done in this run
+        self.done_time = 0.0
+        self.done_count = 0
+        self.deadline: List[Tuple[float, int, Any]] = []
+        self.total = 0
+        self.sources: Deque[Iterator[Any]] = deque()
+        self.failed: Optional[str] = None
+        self.admission = admission() if max_process == 0 else None
+        # hooks for display, called with the name and the job
+        self.on_start: Optional[Callable[[str, Any], None]] = None
+        self.on_done: Optional[Callable[[str, Any], None]] = None
+
+    def add(self,
+            job: Any,
+            name: str = "",
+            on_done: Callback = None,
+            first: bool = False,
+            key: str = "") -> None:
+        """
+        queue a job, `first` puts it before the others.  
+        the time of the job is recorded in the timing history by `key`
+        """
+        self.total += 1
+        item = (job, name or f"No.{self.total}", on_done, key,
+                self.history.expect(key))
+        self.queue.push(item, first)
+
+    def feed(self, source: Iterator[Any]) -> None:
+        """
+        every step of source may add() some jobs,
+        the next step is taken when the queue is empty and a job can start
+        """
+        self.sources.append(source)
+
+    def pull(self) -> bool:
+        """
+        take steps of sources until the queue has `window` jobs,
+        return whether there is a job in the queue
+        """
+        while len(self.queue) < self.window and self.sources:
+            try:
+                next(self.sources[0])
+            except StopIteration:
+                self.sources.popleft()
+        return bool(self.queue)
+
+    def admit(self) -> bool:
+        """
+        whether the next job can start now
+        """
+        if self.admission is not None:
+            return self.admission.allow(len(self.running))
+        if self.max_process == -1:
+            return len(self.running) < 1
+        return len(self.running) < self.max_process
+
+    @log
+    def run(self) -> None:
+        waiter = _get_waiter()
+        ui.detail(f"scheduler use {type(waiter).__name__}")
+        try:
+            self._loop(waiter)
+        except BaseException:
+            for job in self.running:
+                job.halt()
+            raise
+        finally:
+            waiter.close()
+            self.history.flush()
+
+    def _loop(self, waiter: Any) -> None:
+        while self.queue or self.running or self.sources:
+            while self.admit() and self.pull():
+                item = self.queue.pop()
+                job, name = item[0], item[1]
+                with self.tracer.span("spawn", "scheduler", case=name):
+                    job.start()
+                waiter.register(job)
+                self.running[job] = item
+                if job.max_time:
+                    heapq.heappush(
+                        self.deadline,
+                        (job.start_time + job.max_time, id(job), job),
+                    )
+                if self.on_start:
+                    self.on_start(name, job)
+            if not (self.queue or self.running):
+                break  # the sources are exhausted
+            for job in waiter.wait(self._timeout()):
+                if job not in self.running:
+                    continue
+                try:
+                    done = job.check()
+                except OjpackerError:
+                    self.failed = self.running[job][1]
+                    raise
+                if done:
+                    waiter.unregister(job)
+                    _, name, on_done, key, _ = self.running.pop(job)
+                    self.done_time += job.end_time - job.start_time
+                    self.done_count += 1
+                    self.history.record(key, job.end_time - job.start_time)
+                    self.tracer.complete(name, "case", job.start_time,
+                                         job.end_time, lane=True, cmd=job.cmd)
+                    if self.on_done:
+                        self.on_done(name, job)
+                    if on_done:
+                        on_done()
+            self._check_deadline()
+
+    def eta(self) -> Optional[float]:
+        """
+        seconds until the known jobs are done, None if nothing to estimate by.  
+        jobs without history are expected to take the average
+        """
+        queued = self.queue.items()
+        running = list(self.running.values())
+        known = [item[4] for item in queued + running if item[4] is not None]
+        if known:
+            average = sum(known) / len(known)
+        elif self.done_count:
+            average = self.done_time / self.done_count
+        else:
+            return None
+        now = time.time()
+        left = sum(average if expect is None else expect
+                   for _, _, _, _, expect in queued)
+        for job, _, _, _, expect in running:
+            left += max((average if expect is None else expect) -
+                        (now - job.start_time), 0)
+        return left / max(len(running), 1)
+
+    def _timeout(self) -> Optional[float]:
+        while self.deadline and self.deadline[0][2] not in self.running:
+            heapq.heappop(self.deadline)
+        timeout = None
+        if self.deadline:
+            timeout = max(self.deadline[0][0] - time.time(), 0)
+        if (self.queue or self.sources) and self.admission is not None:
+            # held back, sample the load again later
+            interval = self.admission.interval * 2
+            timeout = interval if timeout is None else min(timeout, interval)
+        return timeout
+
+    def _check_deadline(self) -> None:
+        now = time.time()
+        while self.deadline and self.deadline[0][0] <= now:
+            job = heapq.heappop(self.deadline)[2]
+            if job in self.running:
+                self.failed = self.running[job][1]
+                raise OjpackerError(
+                    f"Command '{job.cmd}' exceeded the time limit of {job.max_time} seconds"
+                )
@@ -0,0 +1,92 @@
+from __future__ import absolute_import
+
+import json
+import sys
+from typing import Any, Dict, List
+
+from . import ui
+from .ui import log
+
+sort_keys = ["wall", "cpu", "rss", "output", "name"]
+
+# ru_maxrss is in kilobytes on linux, but in bytes on macOS
+rss_unit = 1 if sys.platform == "darwin" else 1024
+
+
+class record:
+    """
+    resource usage of a completed case
+    """
+    def __init__(self, name: str, job: Any) -> None:
+        self.name = name
+        self.cmd = job.cmd
+        self.wall = job.end_time - job.start_time
+        if job.rusage is not None:
+            self.user = job.rusage.ru_utime
+            self.sys = job.rusage.ru_stime
+            self.rss = job.rusage.ru_maxrss * rss_unit
+        else:
+            self.user = self.sys = 0.0
+            self.rss = 0
+        self.output = job.output_size
+
+    @property
+    def cpu(self) -> float:
+        return self.user + self.sys
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "cmd": self.cmd,
+            "wall": self.wall,
+            "user": self.user,
+            "sys": self.sys,
+            "rss": self.rss,
+            "output": self.output,
+        }
+
+
+@log
+def report(records: List[record], key: str = "wall", limit: int = 20) -> None:
+    """
+    print the `limit` most expensive cases and the total
+    """
+    if not records:
+        return
+    from rich.table import Table
+    rows = sorted(records,
+                  key=lambda rec: getattr(rec, key),
+                  reverse=key != "name")
+    table = Table(title=f"resource usage of {len(rows)} case(s), by {key}")
+    table.add_column("case")
+    for column in ["wall", "cpu", "user", "sys", "peak rss", "output"]:
+        table.add_column(column, justify="right")
+    for rec in rows[:limit]:
+        table.add_row(
+            rec.name,
+            f"{rec.wall:.3f}s",
+            f"{rec.cpu:.3f}s",
+            f"{rec.user:.3f}s",
+            f"{rec.sys:.3f}s",
+            ui.readable_byte(rec.rss),
+            ui.readable_byte(rec.output),
+        )
+    if len(rows) > limit:
+        table.add_row(f"... {len(rows) - limit} more", *[""] * 6)
+    table.add_row(
+        "[bold]total",
+        f"{sum(rec.wall for rec in rows):.3f}s",
+        f"{sum(rec.cpu for rec in rows):.3f}s",
+        f"{sum(rec.user for rec in rows):.3f}s",
+        f"{sum(rec.sys for rec in rows):.3f}s",
+        ui.readable_byte(max(rec.rss for rec in rows)),
+        ui.readable_byte(sum(rec.output for rec in rows)),
+    )
+    ui.console.print(table)
+
+
+@log
+def dump(records: List[record], path: str) -> None:
+    with open(path, "w") as fp:
+        json.dump([rec.to_dict() for rec in records], fp, indent=4)
+    ui.info(f"resource usage has been written to '{path}'")
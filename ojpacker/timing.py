@@ -0,0 +1,81 @@
+from __future__ import absolute_import
+
+import os
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+
+from . import cache, ui
+from .ui import log
+
+db_path = os.path.join(cache.cache_dir, "timing.sqlite")
+
+
+def get_key(file_src: str, case: str) -> str:
+    """
+    a generator and a case of it, the case is a line of state or a file name.
+    the source is not hashed, so the history survives small edits
+    """
+    return cache.get_key("timing", os.path.abspath(file_src), case)
+
+
+def connect() -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    db = sqlite3.connect(db_path, timeout=5)
+    db.execute("CREATE TABLE IF NOT EXISTS timing "
+               "(key TEXT PRIMARY KEY, seconds REAL, updated REAL)")
+    return db
+
+
+class history:
+    """
+    wall time of the cases in the last runs, loaded once,
+    and the records of this run, written by flush()
+    """
+    def __init__(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+        self.known: Optional[Dict[str, float]] = None
+        self.pending: List[Tuple[str, float, float]] = []
+
+    @log
+    def load(self) -> Dict[str, float]:
+        if self.known is None:
+            self.known = {}
+            if self.enabled and os.path.isfile(db_path):
+                try:
+                    db = connect()
+                    self.known = dict(
+                        db.execute("SELECT key, seconds FROM timing"))
+                    db.close()
+                except sqlite3.Error as e:
+                    ui.warning(f"can't read timing database: {e}")
+            ui.detail(f"timing of {len(self.known)} case(s) loaded")
+        return self.known
+
+    def expect(self, key: str) -> Optional[float]:
+        """
+        seconds the case took last time, None if unknown
+        """
+        if not key or not self.enabled:
+            return None
+        return self.load().get(key)
+
+    def record(self, key: str, seconds: float) -> None:
+        if key and self.enabled:
+            self.load()[key] = seconds
+            self.pending.append((key, seconds, time.time()))
+
+    @log
+    def flush(self) -> None:
+        if not self.pending:
+            return
+        try:
+            db = connect()
+            with db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO timing VALUES (?, ?, ?)",
+                    self.pending)
+            db.close()
+        except sqlite3.Error as e:
+            ui.warning(f"can't write timing database: {e}")
+        self.pending.clear()
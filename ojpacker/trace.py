@@ -0,0 +1,133 @@
+from __future__ import absolute_import
+
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from . import ui
+
+
+class _null:
+    def __enter__(self) -> None:
+        pass
+
+    def __exit__(self, *args: Any) -> None:
+        pass
+
+
+_nothing = _null()
+
+
+class _span:
+    def __init__(self, owner: "recorder", name: str, cat: str,
+                 args: Dict[str, Any]) -> None:
+        self.owner = owner
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.start = 0.0
+
+    def __enter__(self) -> None:
+        self.start = time.time()
+
+    def __exit__(self, *args: Any) -> None:
+        self.owner.complete(self.name, self.cat, self.start, time.time(),
+                            **self.args)
+
+
+class recorder:
+    """
+    events of a run. nothing is recorded unless enabled,
+    span() is then a shared no-op
+    """
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self.begin = time.time()
+        self.events: List[Dict[str, Any]] = []
+        # thread id -> name, for the rows of the timeline
+        self.threads: Dict[int, str] = {}
+
+    def span(self, name: str, cat: str = "ojpacker", **args: Any) -> Any:
+        """
+        with span(...): the time of the block, in the row of the current thread
+        """
+        if not self.enabled:
+            return _nothing
+        return _span(self, name, cat, args)
+
+    def complete(self,
+                 name: str,
+                 cat: str,
+                 start: float,
+                 end: float,
+                 lane: bool = False,
+                 **args: Any) -> None:
+        """
+        an event from start to end (time.time()).
+        events with `lane` are not bound to a thread, they are put in the
+        first row free at their start, like the cases running at the same time
+        """
+        if not self.enabled:
+            return
+        tid: Optional[int] = None
+        if not lane:
+            thread = threading.current_thread()
+            tid = thread.ident or 0
+            self.threads.setdefault(tid, thread.name)
+        self.events.append({
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": (start - self.begin) * 1e6,
+            "dur": max(end - start, 0) * 1e6,
+            "pid": os.getpid(),
+            "tid": tid,
+            "args": args,
+        })
+
+    def assign_lanes(self) -> int:
+        """
+        give the events without a thread the lowest free row,
+        return the rows used
+        """
+        free: List[float] = []  # end of the last event of each row
+        for event in sorted(self.events, key=lambda event: event["ts"]):
+            if event["tid"] is not None:
+                continue
+            for row, end in enumerate(free):
+                if end <= event["ts"]:
+                    break
+            else:
+                row = len(free)
+                free.append(0.0)
+            free[row] = event["ts"] + event["dur"]
+            event["tid"] = row + 1
+        return len(free)
+
+    def dump(self, path: str) -> None:
+        """
+        Chrome trace event format, open it in chrome://tracing or Perfetto
+        """
+        rows = self.assign_lanes()
+        names = dict(self.threads)
+        names.update({row: f"case {row}" for row in range(1, rows + 1)})
+        meta = [{
+            "name": "thread_name",
+            "ph": "M",
+            "pid": os.getpid(),
+            "tid": tid,
+            "args": {"name": name},
+        } for tid, name in names.items()]
+        with open(path, "w") as fp:
+            json.dump({
+                "traceEvents": meta + self.events,
+                "displayTimeUnit": "ms",
+            }, fp)
+        ui.info(f"{len(self.events)} trace event(s) have been written to "
+                f"'{path}'")
+
+
+# for the code run outside of a traced run
+off = recorder()
@@ -3,19 +3,46 @@ from __future__ import absolute_import
 import sys
 import time
 from functools import partial, wraps
-from typing import Union
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Union
 
-from rich.console import Console
-from rich.progress import BarColumn, Progress, TimeRemainingColumn
+if TYPE_CHECKING:
+    from rich.console import Console
 
 #console
-console = Console(
-    file=sys.stderr,
-    log_path=False,
-)
+_console: Optional["Console"] = None
+
+
+def get_console() -> "Console":
+    """
+    rich is imported by the first output, so commands that print nothing start fast
+    """
+    global _console
+    if _console is None:
+        from rich.console import Console
+        _console = Console(
+            file=sys.stderr,
+            log_path=False,
+        )
+    return _console
+
+
+class _lazy_console:
+    """
+    ui.console, the attributes are looked up in get_console()
+    """
+    def __getattr__(self, name: str) -> Any:
+        return getattr(get_console(), name)
+
+
+console: Any = _lazy_console()
+
+
+def _log(*args: Any, **kwargs: Any) -> None:
+    get_console().log(*args, **kwargs)
+
 
 # rich print
-rprint = console.log
+rprint = _log
 
 # log
 log_level = 10
@@ -34,32 +61,31 @@ log_head = {
     "debug": "[green]DEBUG[/green]  ",
 }
 
-error = partial(console.log, log_head["error"])
-warning = partial(console.log, log_head["warning"])
-info = partial(console.log, log_head["info"])
-detail = partial(console.log, log_head["detail"])
-debug = partial(console.log, log_head["debug"])
-
-# progress
-progress = partial(
-    Progress,
-    " " * 15,
-    "[progress.description]{task.description:10}",
-    BarColumn(),
-    "{task.completed} of {task.total}",
-    console=console,
-)
-unknown_progress = partial(
-    Progress,
-    " " * 15,
-    "[progress.description]{task.description:10}",
-    BarColumn(),
-    console=console,
-)
+error = partial(_log, log_head["error"])
+warning = partial(_log, log_head["warning"])
+info = partial(_log, log_head["info"])
+detail = partial(_log, log_head["detail"])
+debug = partial(_log, log_head["debug"])
+
+# functions decorated by @log, and their logger if debug is enabled
+logged: List[Callable[..., Any]] = []
+loggers: Dict[Callable[..., Any], Callable[..., Any]] = {}
 
 
 # @log
 def log(func):
+    """
+    the function itself is returned, it's replaced by a logger
+    only when the log level is debug (see set_log_level),
+    so @log costs nothing in other levels
+    """
+    logged.append(func)
+    if log_level <= level_table["debug"]:
+        return _logger(func)
+    return func
+
+
+def _logger(func):
     @wraps(func)
     def logger(*args, **kwargs):
         debug(
@@ -76,15 +102,34 @@ def log(func):
         ret = func(*args, **kwargs)
         return ret
 
+    loggers[func] = logger
     return logger
 
 
+def _patch(enable: bool) -> None:
+    """
+    put the loggers into (or take them out of) the modules and classes
+    """
+    for func in logged:
+        if "<locals>" in func.__qualname__:
+            continue
+        owner = sys.modules[func.__module__]
+        *path, name = func.__qualname__.split(".")
+        for part in path:
+            owner = getattr(owner, part)
+        if enable:
+            setattr(owner, name, loggers.get(func) or _logger(func))
+        else:
+            setattr(owner, name, func)
+
+
 def countdown(second: int) -> None:
+    from rich.progress import Progress, TimeRemainingColumn
     with Progress(
             " " * 15,
             "[progress.description]{task.description:10}",
             TimeRemainingColumn(),
-            console=console,
+            console=get_console(),
             transient=True,
     ) as progress:
         mask = progress.add_task(
@@ -98,6 +143,23 @@ def countdown(second: int) -> None:
             time.sleep(0.05)
 
 
+def readable_byte(value: float) -> str:
+    unit = ["B", "KB", "MB", "GB", "TB"]
+    level = 0
+    while (value >= 1024 and level < len(unit) - 1):
+        value /= 1024
+        level += 1
+    return "%.2f %s" % (value, unit[level])
+
+
+def readable_time(second: float) -> str:
+    minute, second = divmod(int(second + 0.5), 60)
+    hour, minute = divmod(minute, 60)
+    if hour:
+        return "%d:%02d:%02d" % (hour, minute, second)
+    return "%d:%02d" % (minute, second)
+
+
 def set_log_level(level: Union[int, str] = 20, ) -> None:
     global log_level
 
@@ -113,6 +175,8 @@ def set_log_level(level: Union[int, str] = 20, ) -> None:
 
     for level in level_table:
         if log_level <= level_table[level]:
-            globals()[level] = partial(console.log, log_head[level])
+            globals()[level] = partial(_log, log_head[level])
         else:
             globals()[level] = partial(lambda *args, **kwargs: None)
+
+    _patch(log_level <= level_table["debug"])
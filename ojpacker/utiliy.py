@@ -2,17 +2,28 @@ from __future__ import absolute_import
 
 import os
 import shlex
+import signal
 import subprocess
+import tempfile
 import time
-from typing import List, Optional
+from typing import IO, Any, Dict, List, Optional
 
 from typing_extensions import Literal
 
-from . import ui
+try:
+    import resource
+except ImportError:  # not on unix
+    resource = None  # type: ignore
+
+from . import display, scheduler, stats, ui
 from .error import OjpackerError
 from .ui import log
 
 
+# a write of this size never blocks on an empty pipe
+pipe_buf = 4096
+
+
 class popen:
     @log
     def __init__(
@@ -23,8 +34,17 @@ class popen:
             output: Optional[str] = None,
             capture_output: bool = True,
             check_return: bool = True,
-            max_time: Optional[int] = None,
+            max_time: Optional[float] = None,
+            max_cpu: Optional[int] = None,
+            max_memory: Optional[int] = None,
+            max_output: Optional[int] = None,
+            cwd: Optional[str] = None,
     ) -> Optional[str]:
+        """
+        max_time is wall time in seconds, enforced by killing the process group.  
+        max_cpu (seconds), max_memory and max_output (bytes) are set by setrlimit.  
+        cmd runs in cwd, the files of input and output are opened here
+        """
         self.cmd = cmd
         self.typ = typ
         self.input = input
@@ -32,55 +52,108 @@ class popen:
         self.capture_output = capture_output
         self.check_return = check_return
         self.max_time = max_time
+        self.max_cpu = max_cpu
+        self.max_memory = max_memory
+        self.max_output = max_output
+        self.cwd = cwd
         self.is_start = False
+        self.file_in: Optional[IO[bytes]] = None
+        self.file_out: Optional[IO[bytes]] = None
+        # resource usage, filled when it's completed
+        self.end_time: Optional[float] = None
+        self.rusage: Optional[Any] = None
+        self.output_size = 0
 
     @log
     def start(self) -> None:
+        """
+        bytes only, the files are passed to the child without python in between
+        """
+        stderr = None
         if self.typ == "s2s":
-            self.popen = subprocess.Popen(
-                shlex.split(self.cmd),
-                stdin=subprocess.PIPE,
-                stdout=subprocess.PIPE if self.capture_output else None,
-                stderr=subprocess.STDOUT if self.capture_output else None,
-                universal_newlines=True,
-            )
-            if self.input:
-                self.popen.stdin.write(self.input)
-            self.popen.stdin.close()
-        elif self.typ == "s2f":
-            if self.output:
-                self.file_out = open(self.output, 'w')
-            else:
-                raise OjpackerError("popen: need input file, but get nothing")
-            self.popen = subprocess.Popen(
-                shlex.split(self.cmd),
-                stdin=subprocess.PIPE,
-                stdout=self.file_out,
-                stderr=None,
-                universal_newlines=True,
-            )
-            if self.input:
-                self.popen.stdin.write(self.input)
-            self.popen.stdin.close()
-        elif self.typ == "f2f":
+            # a file never blocks the child, no matter how much it prints
+            if self.capture_output:
+                self.file_out = tempfile.TemporaryFile()
+                stderr = subprocess.STDOUT
+        elif self.output:
+            self.file_out = open(self.output, 'wb', buffering=0)
+        else:
+            raise OjpackerError("popen: need output file, but get nothing")
+
+        data = b""
+        if self.typ == "f2f":
             if self.input:
-                self.file_in = open(self.input, 'r')
+                self.file_in = open(self.input, 'rb', buffering=0)
             else:
                 raise OjpackerError("popen: need input file, but get nothing")
-            if self.output:
-                self.file_out = open(self.output, 'w')
-            else:
-                raise OjpackerError("popen: need output file, but get nothing")
-            self.popen = subprocess.Popen(
-                shlex.split(self.cmd),
-                stdin=self.file_in,
-                stdout=self.file_out,
-                stderr=None,
-                universal_newlines=True,
-            )
+        elif self.input:
+            data = self.input.encode()
+            if len(data) > pipe_buf:
+                # too long to write into the pipe without blocking
+                self.file_in = tempfile.TemporaryFile()
+                self.file_in.write(data)
+                self.file_in.seek(0)
+                data = b""
+
+        self.popen = subprocess.Popen(
+            shlex.split(self.cmd),
+            stdin=subprocess.PIPE if self.file_in is None else self.file_in,
+            stdout=self.file_out,
+            stderr=stderr,
+            **self.spawn_args(),
+        )
+        if self.file_in is None:
+            try:
+                self.popen.stdin.write(data)
+                self.popen.stdin.close()
+            except BrokenPipeError:  # the child doesn't read it
+                pass
         self.is_start = True
         self.start_time = time.time()
 
+    def spawn_args(self) -> Dict[str, Any]:
+        """
+        every child leads its own process group, so halt() can kill its children.
+        """
+        args: Dict[str, Any] = {"start_new_session": True, "cwd": self.cwd}
+        if (self.max_cpu or self.max_memory or self.max_output) and resource:
+            args["preexec_fn"] = self.set_rlimit
+        return args
+
+    def set_rlimit(self) -> None:
+        """
+        run in the child before exec
+        """
+        if self.max_cpu:
+            resource.setrlimit(resource.RLIMIT_CPU,
+                               (self.max_cpu, self.max_cpu + 1))
+        if self.max_memory:
+            resource.setrlimit(resource.RLIMIT_AS,
+                               (self.max_memory, self.max_memory))
+        if self.max_output:
+            # a byte over the limit, so the output of exactly max_output passes
+            resource.setrlimit(resource.RLIMIT_FSIZE,
+                               (self.max_output + 1, self.max_output + 1))
+
+    @property
+    def pid(self) -> int:
+        return self.popen.pid
+
+    def poll(self) -> Optional[int]:
+        """
+        like Popen.poll, but reap the child by wait4 to get its resource usage
+        """
+        if self.popen.returncode is not None or not hasattr(os, "wait4"):
+            return self.popen.poll()
+        try:
+            pid, status, self.rusage = os.wait4(self.pid, os.WNOHANG)
+        except ChildProcessError:
+            return self.popen.poll()
+        if pid == 0:
+            return None
+        self.popen.returncode = exit_code(status)
+        return self.popen.returncode
+
     def check(self) -> bool:
         """
         Check whether it is completed, and close the file. 
@@ -88,19 +161,41 @@ class popen:
         """
         if not self.is_start:
             return False
-        returncode = self.popen.poll()
+        returncode = self.poll()
         if returncode is None:
             return False
-        if self.typ[0] == 'f':
-            self.file_in.close()
-        if self.typ[2] == 'f':
-            self.file_out.close()
+        if self.end_time is None:
+            self.end_time = time.time()
+            if self.file_in is not None:
+                self.file_in.close()
+            if self.typ[2] == 'f':
+                self.file_out.close()
+                self.output_size = os.path.getsize(self.output)
+            elif self.file_out is not None:
+                self.output_size = os.fstat(self.file_out.fileno()).st_size
+        if self.max_output and self.output_size > self.max_output:
+            # python ignores SIGXFSZ, the output is cut and it exits with 0
+            raise OjpackerError(self.describe(returncode))
         if (not self.check_return) or returncode == 0:
             return True
         else:
-            raise OjpackerError(
-                f"Command '{self.cmd}' returned non-zero exit status {returncode}"
-            )
+            raise OjpackerError(self.describe(returncode))
+
+    def describe(self, returncode: int) -> str:
+        """
+        error message of a failed command, tell which limit it exceeds
+        """
+        if self.max_cpu and (returncode == -getattr(signal, "SIGXCPU", 0) or
+                             (self.rusage and self.rusage.ru_utime +
+                              self.rusage.ru_stime >= self.max_cpu)):
+            return f"Command '{self.cmd}' exceeded the cpu time limit of {self.max_cpu} seconds"
+        if self.max_output and (returncode == -getattr(signal, "SIGXFSZ", 0)
+                                or self.output_size > self.max_output):
+            return f"Command '{self.cmd}' exceeded the output limit of {ui.readable_byte(self.max_output)}"
+        message = f"Command '{self.cmd}' returned non-zero exit status {returncode}"
+        if self.max_memory:
+            message += f", it may exceed the memory limit of {ui.readable_byte(self.max_memory)}"
+        return message
 
     def join(self) -> None:
         """
@@ -112,6 +207,7 @@ class popen:
             self.start()
         pass_time = time.time() - self.start_time
         if self.max_time and pass_time > self.max_time:
+            self.halt()
             raise OjpackerError(
                 f"Command '{self.cmd}' timed out after {int(pass_time)} seconds"
             )
@@ -120,18 +216,37 @@ class popen:
                 timeout=self.max_time and (self.max_time - pass_time))
             self.check()
         except subprocess.TimeoutExpired:
+            self.halt()
             raise OjpackerError(
                 f"Command '{self.cmd}' timed out after {int(time.time() - self.start_time)} seconds"
             )
 
     def halt(self) -> None:
-        if self.is_start and self.popen.poll() is None:
-            self.popen.kill()
+        """
+        kill the whole process group
+        """
+        if self.is_start and self.poll() is None:
+            try:
+                os.killpg(self.pid, signal.SIGKILL)
+            except (AttributeError, OSError):
+                self.popen.kill()
 
     def get_out(self) -> str:
         if not self.check():
             self.join()
-        return self.popen.stdout.read()
+        self.file_out.seek(0)
+        content = self.file_out.read()
+        self.file_out.close()
+        return content.decode(errors="replace")
+
+
+def exit_code(status: int) -> int:
+    """
+    same as os.waitstatus_to_exitcode, negative for signal
+    """
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
 
 
 @log
@@ -165,49 +280,31 @@ def execute_pool(
         pool: List[popen],
         max_process: int = -1,
 ) -> None:
-    if max_process == -1:
-        with ui.progress() as progress:
-            mask = progress.add_task("running...", total=len(pool))
-            for i in range(len(pool)):
-                ui.detail(f"subprocess {i} start")
-                pool[i].start()
-                pool[i].join()
-                progress.advance(mask)
-        return
-
-    with ui.unknown_progress() as progress:
-        masks = []
-        completed = [False for i in range(len(pool))]
-        for i in range(max_process if max_process else len(pool)):
-            ui.detail(f"subprocess {i} start")
-            masks.append(progress.add_task(f"No.{i+1}", start=False))
-            pool[i].start()
-        nxt, end_cnt = max_process if max_process else len(pool), 0
-        while end_cnt != len(pool):
-            time.sleep(0.1)
-            for i in range(len(pool)):
-                try:
-                    if not completed[i] and pool[i].check():
-                        # completed this
-                        ui.detail(f"subprocess {i} done")
-                        end_cnt += 1
-                        progress.start_task(masks[i])
-                        progress.update(
-                            masks[i],
-                            completed=100,
-                            refresh=True,
-                        )
-                        completed[i] = True
-                        # start next
-                        if nxt < len(pool):
-                            ui.detail(f"subprocess {nxt} start")
-                            masks.append(
-                                progress.add_task(f"No.{nxt+1}", start=False))
-                            pool[nxt].start()
-                            nxt += 1
-                except OjpackerError as e:
-                    for p in pool:
-                        p.halt()
-                    ui.error(str(e))
-                    raise OjpackerError(
-                        f"execute_pool: subprocess {i} get Non-zero exit")
+    runner = scheduler.scheduler(max_process)
+    for job in pool:
+        runner.add(job)
+    execute(runner)
+
+
+@log
+def execute(runner: scheduler.scheduler,
+            records: Optional[List[stats.record]] = None) -> None:
+    """
+    run the scheduler with a progress display,
+    the resource usage of the jobs is appended to records
+    """
+    with display.board(runner) as board:
+
+        def on_done(name: str, job: popen) -> None:
+            if records is not None:
+                records.append(stats.record(name, job))
+            board.on_done(name, job)
+
+        runner.on_start = board.on_start
+        runner.on_done = on_done
+        try:
+            runner.run()
+        except OjpackerError as e:
+            ui.error(str(e))
+            raise OjpackerError(
+                f"execute_pool: subprocess {runner.failed} get Non-zero exit")
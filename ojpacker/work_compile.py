@@ -1,60 +1,103 @@
 from __future__ import absolute_import
 
 import os
+from functools import partial
+from typing import TYPE_CHECKING
 
-from . import config, filetype, garbage, ui, utiliy
+from . import cache, filetype, garbage, scheduler, ui, utiliy
 from .error import OjpackerError
 from .ui import log
 
+if TYPE_CHECKING:
+    from .context import context
+
 
 @log
-def precheck() -> None:
+def precheck(ctx: "context") -> None:
     pass
 
 
 @log
-def run() -> None:
-    if config.input_exec is not None:
-        compile(config.input_exec)
-    if config.output_exec is not None:
-        compile(config.output_exec)
+def run(ctx: "context") -> None:
+    # compilations are independent, run them at the same time
+    runner = scheduler.scheduler(max(ctx.config.max_process, 0),
+                                 tracer=ctx.tracer)
+    if ctx.input_exec is not None:
+        compile(ctx, runner, ctx.input_exec)
+    if ctx.output_exec is not None:
+        compile(ctx, runner, ctx.output_exec)
+    runner.run()
 
 
 @log
-def compile(file: filetype.execfile) -> None:
-
+def compile(ctx: "context", runner: scheduler.scheduler,
+            file: filetype.execfile) -> None:
+    """
+    queue the compilation of file, or restore it from the compile cache
+    """
     if not file.compile_cmd:
         ui.detail(f"{file.src} don't have compile command, skip compile")
         return
 
+    exe_path = os.path.join(ctx.temp_dir, file.exe)
+    key = ""
+    if ctx.config.compile_cache:
+        key = cache.compile_key(ctx, file)
+        message = cache.restore_compile(key, exe_path)
+        if message is not None:
+            ui.info(f"{file.src} is unchanged, use cached {file.exe}")
+            show_message(message)
+            garbage.add(ctx, exe_path)
+            return
+
     ui.info(f"compile {file.src} to {file.exe}")
-    message = utiliy.popen(
-        file.get_compile(exe_dir="temp"),
+    job = utiliy.popen(
+        file.get_compile(exe_dir=ctx.exe_dir()),
         typ="s2s",
         check_return=False,
-    ).get_out()
-    exe_path = os.path.join("temp", file.exe)
+        cwd=ctx.root,
+    )
+    runner.add(job,
+               name=file.src,
+               on_done=partial(check, ctx, file, job, key))
+
+
+@log
+def check(ctx: "context", file: filetype.execfile, job: utiliy.popen,
+          key: str) -> None:
+    message = job.get_out()
+    exe_path = os.path.join(ctx.temp_dir, file.exe)
     ui.detail(f"check {exe_path}, {os.path.isfile(exe_path)}")
     if os.path.isfile(exe_path):
-        if message:
-            if ui.log_level <= ui.level_table["debug"]:
-                ui.console.print("[green]-----compile message-----")
-                ui.console.print(message)
-                ui.console.print("[green]-----compile message-----")
-        else:
-            ui.detail("no compile message")
-        garbage.add(exe_path)
+        show_message(message)
+        if key:
+            cache.store_compile(ctx, key, exe_path, message)
+        garbage.add(ctx, exe_path)
     else:
         if message:
             if ui.log_level <= ui.level_table["warning"]:
                 ui.console.print("[yellow]-----compile message-----")
                 utiliy.popen(
-                    file.get_compile(exe_dir="temp"),
+                    file.get_compile(exe_dir=ctx.exe_dir()),
                     capture_output=False,
                     typ="s2s",
                     check_return=False,
+                    cwd=ctx.root,
                 ).join()
                 ui.console.print("[yellow]-----compile message-----")
         else:
             ui.warning("no compile message")
         raise OjpackerError(f"compilation failed, {exe_path} not found")
+
+
+def show_message(message: str) -> None:
+    """
+    message of a successful compilation is only shown in debug level
+    """
+    if message:
+        if ui.log_level <= ui.level_table["debug"]:
+            ui.console.print("[green]-----compile message-----")
+            ui.console.print(message)
+            ui.console.print("[green]-----compile message-----")
+    else:
+        ui.detail("no compile message")
@@ -1,52 +1,218 @@
 from __future__ import absolute_import
 
 import os
+from functools import partial
+from typing import (TYPE_CHECKING, BinaryIO, Callable, Dict, Iterator, List,
+                    Optional, Tuple)
 
-from . import config, filetype, ui, utiliy
+from . import (cache, filetype, garbage, scheduler, timing, ui, utiliy,
+               work_zip, zygote)
 from .error import OjpackerError
 from .ui import log
 
+if TYPE_CHECKING:
+    from .context import context
+
+Callback = Optional[Callable[[], None]]
+
 
 @log
-def precheck() -> None:
-    if config.input_exec is not None:
-        if not os.path.isfile(config.input_exec.src):
+def precheck(ctx: "context") -> None:
+    if ctx.input_exec is not None:
+        if not os.path.isfile(ctx.path(ctx.input_exec.src)):
+            raise OjpackerError(
+                f"input exec '{ctx.input_exec.src}' not found")
+        if ctx.input_exec.execute_cmd == "":
             raise OjpackerError(
-                f"input exec '{config.input_exec.src}' not found")
-        if config.input_exec.execute_cmd == "":
+                f"'{ctx.input_exec.src}' don't have execute command")
+        if not os.path.isfile(ctx.path(ctx.config.state_name)):
             raise OjpackerError(
-                f"'{config.input_exec.src}' don't have execute command")
-        if not os.path.isfile(config.state_name):
-            raise OjpackerError(f"state file '{config.state_name}' not found")
-        if "{num}" not in config.input_data_name:
+                f"state file '{ctx.config.state_name}' not found")
+        if "{num}" not in ctx.config.input_data_name:
             ui.warning("'input_data_name' don't have macro {num}")
+        zygote.precheck(ctx.input_exec)
 
 
 @log
-def run() -> None:
-    if config.input_exec is None:
+def run(ctx: "context") -> None:
+    if ctx.input_exec is None:
         ui.info("skip the input phase")
         return
-    state = filetype.state_file(config.state_name)
-    input_data = filetype.data_file(config.input_data_name)
-    length = len(state)
-    # make input data
-    ui.info(f"running {config.input_exec.exe}")
-    pool = [
-        utiliy.popen(
-            config.input_exec.get_execute(exe_dir="temp"),
-            typ="s2f",
-            input=state[i],
-            output=input_data.with_path(i),
-        ) for i in range(length) if len(state[i].split()) != 0
-    ]
-    utiliy.execute_pool(pool, config.max_process)
+    runner = scheduler.scheduler(ctx.config.max_process, ctx.timing,
+                                 ctx.tracer)
+    state = add_jobs(ctx, runner)
+    utiliy.execute(runner, ctx.records)
+    report(ctx, len(state))
+
+
+@log
+def add_jobs(
+    ctx: "context",
+    runner: scheduler.scheduler,
+    on_done: Optional[Callable[[int], None]] = None,
+) -> filetype.state_file:
+    """
+    feed make_in for every line of state, the state is read lazily
+    while the runner runs, its length is known after that.  
+    on_done is called with the index after each case completed
+    """
+    assert ctx.input_exec is not None
+    state = filetype.state_file(ctx.path(ctx.config.state_name),
+                                ctx.config.state_expand)
+    ui.info(f"running {ctx.input_exec.exe}")
+    runner.feed(feed_jobs(ctx, runner, state, on_done))
+    return state
+
+
+def feed_jobs(
+    ctx: "context",
+    runner: scheduler.scheduler,
+    state: filetype.state_file,
+    on_done: Optional[Callable[[int], None]],
+) -> Iterator[None]:
+    """
+    one step for each line of state
+    """
+    assert ctx.input_exec is not None
+    input_data = ctx.input_data()
+
+    def finish(i: int) -> None:
+        work_zip.add(ctx, input_data.with_path(i))
+        if on_done:
+            on_done(i)
+
+    exec_key = ""
+    if ctx.config.use_cache:
+        exec_key = cache.exec_hash(ctx, ctx.input_exec)
+    batch: List[Tuple[int, str, Callback]] = []
+    # occurrences of each line, repeated lines of a random generator differ
+    seen: Dict[str, int] = {}
+    for i, line in enumerate(state):
+        if len(line.split()) == 0:
+            continue
+        path = input_data.with_path(i)
+        if ctx.config.use_cache:
+            seen[line] = seen.get(line, 0) + 1
+            key = cache.get_key("in", exec_key, line, str(seen[line]))
+            if cache.restore(ctx, key, path):
+                finish(i)
+                yield
+                continue
+            done: Callback = partial(_cached, ctx, key, path,
+                                     partial(finish, i))
+        else:
+            done = partial(finish, i)
+        if ctx.input_exec.batch:
+            batch.append((i, line, done))
+            continue
+        runner.add(
+            zygote.get_popen(
+                ctx,
+                ctx.input_exec,
+                typ="s2f",
+                input=line,
+                output=path,
+            ),
+            name=f"in {i+1}",
+            on_done=done,
+            key=timing.get_key(ctx.path(ctx.input_exec.src), line),
+        )
+        yield
+    if batch:
+        add_batch_jobs(ctx, runner, batch)
+
+
+def _cached(ctx: "context", key: str, path: str, on_done: Callback) -> None:
+    cache.store(ctx, key, path)
+    if on_done:
+        on_done()
+
+
+@log
+def add_batch_jobs(
+    ctx: "context",
+    runner: scheduler.scheduler,
+    cases: List[Tuple[int, str, Callback]],
+) -> None:
+    """
+    batch protocol: each worker reads many lines of state from stdin,
+    and prints a line of batch_delimiter after the data of every line.  
+    the cases are dealt to the workers in turn
+    """
+    assert ctx.input_exec is not None
+    workers = min(ctx.input_exec.batch, len(cases))
+    ui.info(f"{len(cases)} case(s) in {workers} batch worker(s)")
+    for k in range(workers):
+        part = cases[k::workers]
+        state_path = os.path.join(ctx.temp_dir, f"ojpacker-batch{k+1}.in")
+        output_path = os.path.join(ctx.temp_dir,
+                                   f"ojpacker-batch{k+1}.out")
+        with open(state_path, "w") as fp:
+            for _, line, _ in part:
+                fp.write(line + "\n")
+        garbage.add(ctx, state_path, output_path)
+        runner.add(
+            utiliy.popen(
+                ctx.input_exec.get_execute(exe_dir=ctx.exe_dir()),
+                typ="f2f",
+                input=state_path,
+                output=output_path,
+                **ctx.input_exec.limits(),
+                cwd=ctx.root,
+            ),
+            name=f"batch {k+1}",
+            on_done=partial(split_batch, ctx, output_path, part),
+        )
+
+
+@log
+def split_batch(ctx: "context", path: str,
+                cases: List[Tuple[int, str, Callback]]) -> None:
+    """
+    split the output of a batch worker into input files
+    """
+    assert ctx.input_exec is not None
+    input_data = ctx.input_data()
+    delimiter = ctx.input_exec.batch_delimiter.encode()
+    count = 0
+    out: Optional[BinaryIO] = None
+    with open(path, "rb") as fp:
+        for line in fp:
+            if count == len(cases):
+                break
+            if line.rstrip(b"\r\n") == delimiter:
+                index, _, done = cases[count]
+                if out is None:  # empty case
+                    out = open(input_data.with_path(index), "wb")
+                out.close()
+                out = None
+                count += 1
+                if done:
+                    done()
+                continue
+            if out is None:
+                out = open(input_data.with_path(cases[count][0]), "wb")
+            out.write(line)
+        else:
+            line = b""
+    if out is not None:
+        out.close()
+    if count != len(cases) or line.strip():
+        raise OjpackerError(
+            f"batch output '{path}' doesn't match: expected {len(cases)} case(s) "
+            f"ended by '{ctx.input_exec.batch_delimiter}'")
+
+
+@log
+def report(ctx: "context", length: int) -> None:
+    ui.info(f"{length} case(s) in state")
+    input_data = ctx.input_data()
 
     # check empty
     utiliy.check_empty([input_data.with_path(i) for i in range(length)])
 
     # print input
-    if config.show_input:
+    if ctx.config.show_input:
         detail = [
             "   {name} : {content}".format(
                 name="[purple]{:<10}[/purple]".format(input_data[i]),
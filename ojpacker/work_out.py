@@ -1,74 +1,239 @@
 from __future__ import absolute_import
 
 import os
-from typing import List
+from functools import partial
+from typing import TYPE_CHECKING, Dict, Iterator, List, Set
 
-from . import config, filetype, ui, utiliy
+from . import (cache, filetype, scheduler, timing, ui, utiliy, work_zip,
+               zygote)
 from .error import OjpackerError
 from .ui import log
 
+if TYPE_CHECKING:
+    from .context import context
+
 
 @log
-def precheck() -> None:
-    if config.output_exec is not None:
-        if not os.path.isfile(config.output_exec.src):
+def precheck(ctx: "context") -> None:
+    if ctx.output_exec is not None:
+        if not os.path.isfile(ctx.path(ctx.output_exec.src)):
             raise OjpackerError(
-                f"output exec '{config.output_exec.src}' not found")
-        if config.output_exec.execute_cmd == "":
+                f"output exec '{ctx.output_exec.src}' not found")
+        if ctx.output_exec.execute_cmd == "":
             raise OjpackerError(
-                f"'{config.output_exec.src}' don't have execute command")
-        if config.input_dir != "temp":
-            if not os.path.isdir(config.input_dir):
+                f"'{ctx.output_exec.src}' don't have execute command")
+        if ctx.config.input_dir:
+            if not os.path.isdir(ctx.path(ctx.config.input_dir)):
                 raise OjpackerError(
-                    f"input directory '{config.input_dir}' does not exist")
-            elif not os.path.isfile(
-                    os.path.join(
-                        config.input_dir,
-                        config.output_data_name.format(num=1),
-                    ), ):
+                    f"input directory '{ctx.config.input_dir}' does not exist")
+            elif not ctx.input_data(ctx.path(
+                    ctx.config.input_dir)).scan()[0]:
                 raise OjpackerError(
-                    f"Unable to match '{config.output_data_name}' in directory '{config.input_dir}'"
+                    f"Unable to match '{ctx.config.input_data_name}' in directory '{ctx.config.input_dir}'"
                 )
-        if "{num}" not in config.input_data_name and config.input_exec is None:
+        if "{num}" not in ctx.config.input_data_name and ctx.input_exec is None:
             ui.warning("'input_data_name' don't have macro {num}")
-        if "{num}" not in config.output_data_name:
+        if "{num}" not in ctx.config.output_data_name:
             ui.warning("'output_data_name' don't have macro {num}")
+        zygote.precheck(ctx.output_exec)
 
 
 @log
-def run() -> None:
-    if config.output_exec is None:
+def run(ctx: "context") -> None:
+    if ctx.output_exec is None:
         ui.info("skip the output stage")
         return
-    input_data = filetype.data_file(config.input_data_name,
-                                    path=config.input_dir)
-    output_data = filetype.data_file(config.output_data_name)
-    # make output data
-    length = 0
-    pool: List[utiliy.popen] = []
-    while os.path.isfile(input_data.with_path(length)):
-        pool.append(
-            utiliy.popen(
-                config.output_exec.get_execute(exe_dir="temp"),
-                typ="f2f",
-                input=input_data.with_path(length),
-                output=output_data.with_path(length),
-            ))
-        length += 1
-    ui.info(f"{length} inputs file detected")
-    ui.info(f"running {config.output_exec.exe}")
-    utiliy.execute_pool(pool, config.max_process)
+    source = ctx.input_data(
+        ctx.path(ctx.config.input_dir) if ctx.config.input_dir else "")
+    input_data = ctx.input_data()
+    indexes = discover(ctx, source)
+    duplicates = dedup(ctx)
+    runner = scheduler.scheduler(ctx.config.max_process, ctx.timing,
+                                 ctx.tracer)
+    runner.feed(
+        feed_jobs(ctx, runner, indexes, source, input_data, duplicates))
+    ui.info(f"running {ctx.output_exec.exe}")
+    utiliy.execute(runner, ctx.records)
+    report(ctx, indexes)
+    duplicates.report()
+
+
+@log
+def discover(ctx: "context", source: filetype.data_file) -> List[int]:
+    """
+    indexes of the inputs in the directory, gaps are allowed
+    """
+    with ctx.tracer.span("discover", "phase", dir=source.path):
+        indexes, unmatched = source.scan()
+    ui.info(f"{len(indexes)} inputs file detected")
+    missing = len(indexes) and indexes[-1] + 1 - len(indexes)
+    # files in temp are made by us, gaps there are blank lines of state
+    show = ui.info if ctx.config.input_dir else ui.detail
+    if missing:
+        show(f"{missing} case(s) missing: {gaps(indexes)}")
+    if unmatched and ctx.config.input_dir:
+        shown = ", ".join(f"'{name}'" for name in unmatched[:5])
+        more = f" and {len(unmatched) - 5} more" if len(unmatched) > 5 else ""
+        ui.warning(
+            f"{len(unmatched)} file(s) don't match '{ctx.config.input_data_name}': {shown}{more}"
+        )
+    return indexes
+
+
+def gaps(indexes: List[int]) -> str:
+    """
+    numbers of the cases that are not in sorted indexes, like "2, 5-7"
+    """
+    parts = []
+    last = -1
+    for index in indexes:
+        if index > last + 1:
+            begin, end = last + 2, index
+            parts.append(f"{begin}" if begin == end else f"{begin}-{end}")
+        last = index
+    return ", ".join(parts)
+
+
+def feed_jobs(
+    ctx: "context",
+    runner: scheduler.scheduler,
+    indexes: List[int],
+    source: filetype.data_file,
+    input_data: filetype.data_file,
+    duplicates: "dedup",
+) -> Iterator[None]:
+    for index in indexes:
+        if ctx.config.input_dir:
+            # inputs from another directory are packed as well
+            cache.clone(source.with_path(index),
+                        input_data.with_path(index),
+                        link=ctx.config.will_zip)
+            work_zip.add(ctx, input_data.with_path(index))
+        add_job(ctx, runner, index, input_data, duplicates)
+        yield
+
+
+class dedup:
+    """
+    make_out runs once for identical inputs,
+    the output is cloned to the other cases
+    """
+    def __init__(self, ctx: "context") -> None:
+        self.ctx = ctx
+        # hash of input -> indexes, the first one runs
+        self.groups: Dict[str, List[int]] = {}
+        self.done: Set[str] = set()
+
+    def add(self, digest: str, index: int) -> bool:
+        """
+        whether the case should run
+        """
+        group = self.groups.setdefault(digest, [])
+        group.append(index)
+        if len(group) == 1:
+            return True
+        if digest in self.done:
+            self.copy(group[0], index)
+        return False
+
+    def finish(self, digest: str) -> None:
+        self.done.add(digest)
+        group = self.groups[digest]
+        for index in group[1:]:
+            self.copy(group[0], index)
+
+    def copy(self, src: int, dst: int) -> None:
+        output_data = self.ctx.output_data()
+        cache.clone(output_data.with_path(src),
+                    output_data.with_path(dst),
+                    link=self.ctx.config.will_zip)
+        work_zip.add(self.ctx, output_data.with_path(dst))
+
+    @log
+    def report(self) -> None:
+        """
+        identical inputs usually mean a weak test set
+        """
+        input_data = self.ctx.input_data()
+        groups = [group for group in self.groups.values() if len(group) > 1]
+        if not groups:
+            return
+        count = sum(len(group) - 1 for group in groups)
+        ui.warning(f"{count} input(s) are duplicates, "
+                   "make_out ran once for each distinct input")
+        for group in groups[:5]:
+            ui.warning("   identical: " +
+                       ", ".join(input_data[i] for i in sorted(group)))
+        if len(groups) > 5:
+            ui.warning(f"   and {len(groups) - 5} more group(s)")
+
+
+@log
+def add_job(
+    ctx: "context",
+    runner: scheduler.scheduler,
+    index: int,
+    input_data: filetype.data_file,
+    duplicates: dedup,
+    first: bool = False,
+) -> None:
+    """
+    queue make_out for the case `index`, unless its input is a duplicate
+    """
+    assert ctx.output_exec is not None
+    output_data = ctx.output_data()
+    path = output_data.with_path(index)
+    digest = cache.file_hash(input_data.with_path(index))
+    if not duplicates.add(digest, index):
+        return
+    on_done = partial(_finish, ctx, duplicates, digest, path, "")
+    if ctx.config.use_cache:
+        key = cache.get_key("out", cache.exec_hash(ctx, ctx.output_exec),
+                            digest)
+        if cache.restore(ctx, key, path):
+            _finish(ctx, duplicates, digest, path, "")
+            return
+        on_done = partial(_finish, ctx, duplicates, digest, path, key)
+    runner.add(
+        zygote.get_popen(
+            ctx,
+            ctx.output_exec,
+            typ="f2f",
+            input=input_data.with_path(index),
+            output=path,
+        ),
+        name=f"out {index+1}",
+        on_done=on_done,
+        first=first,
+        key=timing.get_key(ctx.path(ctx.output_exec.src), input_data[index]),
+    )
+
+
+def _finish(ctx: "context", duplicates: dedup, digest: str, path: str,
+            key: str) -> None:
+    """
+    key of the cache to store, empty if not
+    """
+    if key:
+        cache.store(ctx, key, path)
+    work_zip.add(ctx, path)
+    duplicates.finish(digest)
+
+
+@log
+def report(ctx: "context", indexes: List[int]) -> None:
+    output_data = ctx.output_data()
 
     #check empty
-    utiliy.check_empty([output_data.with_path(i) for i in range(length)])
+    utiliy.check_empty([output_data.with_path(i) for i in indexes])
 
     #print output
-    if config.show_output:
+    if ctx.config.show_output:
         detail = [
             "   {name} : {content}".format(
                 name="[purple]{:<10}[/purple]".format(output_data[i]),
                 content=utiliy.file_head(output_data.with_path(i)),
-            ) for i in range(length)
+            ) for i in indexes
         ]
         for line in detail:
             ui.rprint(line)
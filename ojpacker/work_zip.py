@@ -1,54 +1,202 @@
 from __future__ import absolute_import
 
 import os
+import queue
 import shutil
+import stat
+import threading
+import zipfile
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, Any, Optional, Set
 
-from . import config, ui
+from . import archive, scheduler, ui
 from .error import OjpackerError
 from .ui import log
 
+if TYPE_CHECKING:
+    from .context import context
+
+
+class stream:
+    """
+    an archive written by a background thread while the cases are still running.
+    members are queued by add() as soon as they are complete,
+    and compressed by the threads of archive.writer
+    """
+    @log
+    def __init__(self, ctx: "context", path: str, base: str = "") -> None:
+        self.path = path
+        self.temp_dir = ctx.temp_dir
+        self.archive = archive.get_writer(ctx.config.archive_format, path,
+                                          ctx.config.zip_level,
+                                          scheduler.cpu_count(), base,
+                                          ctx.tracer)
+        self.queue: "queue.Queue[Optional[Future[Any]]]" = queue.Queue()
+        self.added: Set[str] = set()
+        self.error: Optional[BaseException] = None
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    def add(self, file_name: str) -> None:
+        """
+        file_name should be in the temporary directory and never change later
+        """
+        arcname = os.path.relpath(file_name, self.temp_dir).replace(
+            os.sep, "/")
+        if arcname not in self.added:
+            self.added.add(arcname)
+            self.queue.put(self.archive.submit(arcname, file_name))
+
+    def work(self) -> None:
+        while True:
+            future = self.queue.get()
+            if future is None:
+                return
+            if self.error is not None:
+                continue
+            try:
+                self.archive.write(future.result())
+            except BaseException as e:
+                self.error = e
+
+    @log
+    def close(self) -> None:
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None:
+            self.archive.abort()
+            raise OjpackerError(f"compression failed: {self.error}")
+        self.archive.close()
+
+    @log
+    def abort(self) -> None:
+        try:
+            self.close()
+        except OjpackerError:
+            pass
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
 
 @log
-def precheck() -> None:
-    if config.will_zip:
-        if config.zip_name == "":
+def precheck(ctx: "context") -> None:
+    if ctx.config.will_zip:
+        if ctx.config.zip_name == "":
             raise OjpackerError("zip name is empty")
-        for file in config.zip_list:
-            if not os.path.isfile(file):
+        archive.check(ctx.config.archive_format, ctx.config.zip_level)
+        for file in ctx.config.zip_list:
+            if not os.path.isfile(ctx.path(file)):
                 ui.warning(f"'{file}' in zip_list, does not exist")
 
 
 @log
-def run() -> None:
-    def readable_byte(value: float) -> str:
-        unit = ["B", "KB", "MB", "GB"]
-        level = 0
-        while (value >= 1024):
-            value /= 1024
-            level += 1
-        return "%.2f %s" % (value, unit[level])
+def start(ctx: "context") -> None:
+    """
+    open the archive before the cases run, written next to the final one
+    """
+    if ctx.config.will_zip:
+        path = archive_path(ctx)
+        base = ""
+        if ctx.config.update_zip and os.path.isfile(path):
+            if path.endswith(".zip") and zipfile.is_zipfile(path):
+                base = path
+                ui.info(f"update '{path}', unchanged members are reused")
+            else:
+                ui.warning(f"'{path}' can't be updated, rebuild it")
+        # runs of a process may pack the same problem at the same time
+        ctx.writer = stream(ctx, f"{path}.{os.getpid()}.{id(ctx)}.part",
+                            base)
+
+
+def archive_path(ctx: "context") -> str:
+    """
+    absolute, the archive is made in root
+    """
+    return ctx.path(ctx.config.zip_name +
+                    archive.suffix(ctx.config.archive_format))
+
+
+@log
+def add(ctx: "context", file_name: str) -> None:
+    """
+    a complete member, compressed at once if the archive is streaming
+    """
+    if ctx.writer is not None:
+        ctx.writer.add(file_name)
+
+
+@log
+def abort(ctx: "context") -> None:
+    if ctx.writer is not None:
+        ctx.writer.abort()
+        ctx.writer = None
+
 
+@log
+def run(ctx: "context") -> None:
     # 复制 zip_list
-    if config.zip_list:
-        for file_name in config.zip_list:
+    if ctx.config.zip_list:
+        for file_name in ctx.config.zip_list:
             ui.info(f"copy {file_name} to temporary directory")
-            if not os.path.isfile(file_name):
+            if not os.path.isfile(ctx.path(file_name)):
                 ui.warning(f"{file_name} not found, skip")
                 continue
-            shutil.copyfile(file_name, os.path.join("temp", file_name))
-
-    if config.will_zip:
-        if os.path.isfile(config.zip_name + ".zip"):
-            ui.warning(f"already have {config.zip_name}.zip, remove in 10s")
-            ui.countdown(10)
-            ui.info(f"remove old {config.zip_name}.zip")
-            os.remove(config.zip_name + ".zip")
-        ui.info("start compression")
-        shutil.make_archive(base_name=config.zip_name,
-                            format="zip",
-                            root_dir="temp")
-        zip_size = readable_byte(os.path.getsize(config.zip_name + ".zip"))
-        ui.info(f"compression complete: '{config.zip_name}.zip' {zip_size}")
+            shutil.copyfile(ctx.path(file_name),
+                            os.path.join(ctx.temp_dir, file_name))
+
+    if ctx.config.will_zip:
+        if ctx.writer is None:
+            start(ctx)
+        writer = ctx.writer
+        assert writer is not None
+        ui.info("finish compression")
+        # everything left in temp which is not streamed yet
+        for root, dirs, files in os.walk(ctx.temp_dir):
+            dirs.sort()
+            for name in sorted(files):
+                writer.add(os.path.join(root, name))
+        writer.close()
+        part, result, ctx.writer = writer.path, writer.archive, None
+        zip_path = archive_path(ctx)
+        if os.path.isfile(zip_path) and not (ctx.config.assume_yes
+                                             or ctx.config.update_zip):
+            ui.warning(f"already have {zip_path}, replace in 10s")
+            try:
+                ui.countdown(10)
+            except BaseException:
+                os.remove(part)
+                raise
+            ui.info(f"replace old {zip_path}")
+        os.replace(part, zip_path)
+        report(zip_path, result)
     else:
-        shutil.move("temp", config.zip_name)
-        ui.info(f"data has been stored in directory '{config.zip_name}'")
+        # mkdtemp made it private, the output follows umask like mkdir.
+        # umask is read from a new directory, setting it races other threads
+        probe = os.path.join(ctx.temp_dir, ".ojpacker-mode")
+        os.mkdir(probe)
+        os.chmod(ctx.temp_dir, stat.S_IMODE(os.stat(probe).st_mode))
+        os.rmdir(probe)
+        shutil.move(ctx.temp_dir, ctx.path(ctx.config.zip_name))
+        ui.info(f"data has been stored in directory '{ctx.config.zip_name}'")
+
+
+@log
+def report(zip_path: str, result: archive.writer) -> None:
+    """
+    ratio is compressed / raw. throughput is raw bytes per second of the time
+    anything was compressed, and per second a thread was busy
+    """
+    size = os.path.getsize(zip_path)
+    message = f"compression complete: '{zip_path}' {ui.readable_byte(size)}"
+    if result.raw_size:
+        raw = ui.readable_byte(result.raw_size)
+        message += f", {size / result.raw_size:.1%} of {raw}"
+    if result.wall:
+        speed = ui.readable_byte(int(result.raw_size / result.wall))
+        message += f", {speed}/s"
+    if result.busy:
+        speed = ui.readable_byte(int(result.raw_size / result.busy))
+        message += f", {speed}/s per busy thread"
+    ui.info(message)
+    if isinstance(result, archive.zip_writer) and result.base:
+        ui.info(f"{result.reused} of {len(result.members)} member(s) reused")
@@ -2,48 +2,168 @@ from __future__ import absolute_import
 
 import os
 import shutil
+import tempfile
+import zipfile
+from typing import TYPE_CHECKING, List
 
-from . import config, garbage, ui, work_compile, work_in, work_out, work_zip
+from . import (cache, garbage, scheduler, stats, ui, utiliy, work_compile,
+               work_in, work_out, work_zip, zygote)
+from .error import OjpackerError
 from .ui import log
 
+if TYPE_CHECKING:
+    from .context import context
+
+# keep some space for the data that can't be estimated
+min_free = 64 * 1024 * 1024
+
 
 @log
-def work() -> None:
+def work(ctx: "context") -> None:
     """
     main function of workflow
     """
-    precheck()
-    run()
+    try:
+        precheck(ctx)
+        run(ctx)
+    finally:
+        if ctx.config.trace_file:
+            ctx.tracer.dump(ctx.path(ctx.config.trace_file))
+    if ctx.config.stats_sort:
+        stats.report(ctx.records, ctx.config.stats_sort)
+    if ctx.config.stats_json:
+        stats.dump(ctx.records, ctx.path(ctx.config.stats_json))
 
 
 @log
-def precheck() -> None:
-    if (config.input_exec is None) and (config.output_exec is None):
+def precheck(ctx: "context") -> None:
+    select_workspace(ctx)
+    if (ctx.input_exec is None) and (ctx.output_exec is None):
         ui.warning("both input phase and output phase will be skipped")
-    elif (config.input_exec is None) and config.input_dir == "temp":
+    elif (ctx.input_exec is None) and not ctx.config.input_dir:
+        ctx.config.input_dir = "temp"
         ui.warning("skip input phase and fetch output phase data from 'temp'")
-    work_compile.precheck()
-    work_in.precheck()
-    work_out.precheck()
-    work_zip.precheck()
+    work_compile.precheck(ctx)
+    work_in.precheck(ctx)
+    work_out.precheck(ctx)
+    work_zip.precheck(ctx)
+
+
+@log
+def run(ctx: "context") -> None:
+    mkdir_temp(ctx)
+    try:
+        run_phases(ctx)
+    except BaseException:
+        work_zip.abort(ctx)
+        if ui.log_level <= ui.level_table["debug"]:
+            ui.debug(f"keep '{ctx.temp_dir}' for debugging")
+        else:
+            garbage.clean(ctx, clean_dir=True)
+        raise
+    finally:
+        zygote.close_all(ctx)
+
+
+@log
+def run_phases(ctx: "context") -> None:
+    work_zip.start(ctx)
+    with ctx.tracer.span("compile", "phase"):
+        work_compile.run(ctx)
+    if ctx.config.pipeline and (ctx.input_exec is not None) and (
+            ctx.output_exec is not None):
+        with ctx.tracer.span("pipeline", "phase"):
+            run_pipeline(ctx)
+    else:
+        with ctx.tracer.span("make_in", "phase"):
+            work_in.run(ctx)
+        with ctx.tracer.span("make_out", "phase"):
+            work_out.run(ctx)
+    if ctx.config.use_cache:
+        cache.report(ctx)
+    if ctx.config.use_cache or ctx.config.compile_cache:
+        cache.evict(ctx)
+    garbage.clean(ctx)
+    with ctx.tracer.span("archive", "phase"):
+        work_zip.run(ctx)
+    garbage.clean(ctx, clean_dir=True)
+
+
+@log
+def run_pipeline(ctx: "context") -> None:
+    """
+    make_out of a case is queued as soon as its make_in exits,
+    both phases share the same scheduler
+    """
+    runner = scheduler.scheduler(ctx.config.max_process, ctx.timing,
+                                 ctx.tracer)
+    input_data = ctx.input_data()
+    indexes: List[int] = []
+    duplicates = work_out.dedup(ctx)
+
+    def on_done(index: int) -> None:
+        indexes.append(index)
+        work_out.add_job(ctx,
+                         runner,
+                         index,
+                         input_data,
+                         duplicates,
+                         first=True)
+
+    state = work_in.add_jobs(ctx, runner, on_done=on_done)
+    ui.info(f"running {ctx.output_exec.exe} in pipeline")
+    utiliy.execute(runner, ctx.records)
+    work_in.report(ctx, len(state))
+    work_out.report(ctx, sorted(indexes))
+    duplicates.report()
+
+
+@log
+def select_workspace(ctx: "context") -> None:
+    """
+    use the workspace if it has enough space, otherwise root
+    """
+    if not ctx.config.workspace:
+        return
+    if not os.path.isdir(ctx.path(ctx.config.workspace)):
+        raise OjpackerError(f"workspace '{ctx.config.workspace}' does not exist")
+    need = estimate_size(ctx)
+    free = shutil.disk_usage(ctx.path(ctx.config.workspace)).free
+    ui.detail(f"workspace free {free}, estimated {need}")
+    if free < need + min_free:
+        ui.warning(
+            f"workspace '{ctx.config.workspace}' only has {ui.readable_byte(free)} free, "
+            f"about {ui.readable_byte(need)} is needed. use the problem directory"
+        )
+        ctx.config.workspace = ""
+        return
+    ui.info(f"use workspace '{ctx.config.workspace}'")
 
 
 @log
-def run() -> None:
-    mkdir_temp()
-    work_compile.run()
-    work_in.run()
-    work_out.run()
-    garbage.clean()
-    work_zip.run()
-    garbage.clean(clean_dir=True)
+def estimate_size(ctx: "context") -> int:
+    """
+    uncompressed size of the last result, 0 if unknown
+    """
+    archive = work_zip.archive_path(ctx)
+    if zipfile.is_zipfile(archive):
+        with zipfile.ZipFile(archive) as fp:
+            return sum(info.file_size for info in fp.infolist())
+    if os.path.isfile(archive):
+        # members of tar are not indexed, the compressed size is a lower bound
+        return os.path.getsize(archive)
+    directory = ctx.path(ctx.config.zip_name)
+    if os.path.isdir(directory):
+        return sum(entry.stat().st_size for entry in os.scandir(directory)
+                   if entry.is_file())
+    return 0
 
 
 @log
-def mkdir_temp() -> None:
-    # mkdir
-    if config.input_exec is not None:
-        if os.path.isdir("temp"):
-            ui.warning("'temp' already exists, [red]deleted[/red]")
-            shutil.rmtree("temp")
-        os.mkdir("temp")
+def mkdir_temp(ctx: "context") -> None:
+    """
+    every run has its own temporary directory, so runs never interfere
+    """
+    ctx.temp_dir = tempfile.mkdtemp(prefix="ojpacker-",
+                                    dir=ctx.path(ctx.config.workspace))
+    ui.detail(f"temporary directory '{ctx.temp_dir}'")
@@ -0,0 +1,235 @@
+from __future__ import absolute_import
+
+import array
+import json
+import os
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+from . import filetype, ui, utiliy
+from .error import OjpackerError
+from .ui import log
+
+if TYPE_CHECKING:
+    from .context import context
+
+server_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "zygote_server.py")
+
+# message boundaries are needed, seqpacket also reports the close of peer
+ctrl_type = getattr(socket, "SOCK_SEQPACKET", socket.SOCK_DGRAM) \
+    if sys.platform.startswith("linux") else socket.SOCK_DGRAM
+
+
+class zygote:
+    """
+    a warm python process of the generator, it forks a child for each case
+    """
+    @log
+    def __init__(self,
+                 file: filetype.execfile,
+                 exe_dir: str = "",
+                 cwd: Optional[str] = None) -> None:
+        interpreter, args = split_execute(file, exe_dir)
+        self.ctrl, remote = socket.socketpair(socket.AF_UNIX, ctrl_type)
+        self.process = subprocess.Popen(
+            interpreter + [
+                server_path,
+                file.src,
+                str(remote.fileno()),
+                json.dumps(file.preload),
+                json.dumps(args),
+            ],
+            stdin=subprocess.DEVNULL,
+            pass_fds=(remote.fileno(), ),
+            start_new_session=True,
+            cwd=cwd,
+        )
+        remote.close()
+        ui.detail(f"zygote of {file.src} started, pid {self.process.pid}")
+
+    def spawn(
+        self,
+        stdin_fd: int,
+        stdout_fd: int,
+        limits: Dict[str, Optional[int]],
+    ) -> Tuple[int, socket.socket, bytes]:
+        """
+        return the pid, the status socket, and the data after pid
+        """
+        status, remote = socket.socketpair()
+        fds = array.array("i", [stdin_fd, stdout_fd, remote.fileno()])
+        try:
+            self.ctrl.sendmsg(
+                [json.dumps(limits).encode()],
+                [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds.tobytes())],
+            )
+        except OSError:
+            raise OjpackerError("zygote exited unexpectedly")
+        finally:
+            remote.close()
+        buffer = b""
+        while b"\n" not in buffer:
+            data = status.recv(4096)
+            if not data:
+                raise OjpackerError("zygote exited unexpectedly")
+            buffer += data
+        pid, rest = buffer.split(b"\n", 1)
+        return int(pid), status, rest
+
+    @log
+    def close(self) -> None:
+        try:
+            self.ctrl.send(b"quit")
+        except OSError:
+            pass
+        self.ctrl.close()
+        try:
+            self.process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+class rusage:
+    def __init__(self, info: Dict[str, Any]) -> None:
+        self.ru_utime = info["utime"]
+        self.ru_stime = info["stime"]
+        self.ru_maxrss = info["maxrss"]
+
+
+class zygote_popen(utiliy.popen):
+    """
+    same as popen with typ s2f or f2f, but forked from a zygote
+    """
+    def __init__(self, server: zygote, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.server = server
+        self.buffer = b""
+        self.returncode: Optional[int] = None
+
+    @log
+    def start(self) -> None:
+        if self.typ == "s2f":
+            self.file_in = tempfile.TemporaryFile()
+            if self.input:
+                self.file_in.write(self.input.encode())
+                self.file_in.seek(0)
+        elif self.typ == "f2f":
+            if not self.input:
+                raise OjpackerError("popen: need input file, but get nothing")
+            self.file_in = open(self.input, "rb", buffering=0)
+        else:
+            raise OjpackerError(f"zygote: unsupported type {self.typ}")
+        if not self.output:
+            raise OjpackerError("popen: need output file, but get nothing")
+        self.file_out = open(self.output, "wb", buffering=0)
+        self._pid, self.status, self.buffer = self.server.spawn(
+            self.file_in.fileno(),
+            self.file_out.fileno(),
+            {
+                "cpu": self.max_cpu,
+                "memory": self.max_memory,
+                "output": self.max_output,
+            },
+        )
+        self.status.setblocking(False)
+        self.is_start = True
+        self.start_time = time.time()
+
+    @property
+    def pid(self) -> int:
+        return self._pid
+
+    def halt(self) -> None:
+        if self.is_start and self.poll() is None:
+            try:
+                os.killpg(self.pid, signal.SIGKILL)
+            except OSError:  # setsid is not called yet
+                os.kill(self.pid, signal.SIGKILL)
+
+    def fileno(self) -> int:
+        """
+        readable when the zygote reports the exit
+        """
+        return self.status.fileno()
+
+    def poll(self) -> Optional[int]:
+        if self.returncode is not None:
+            return self.returncode
+        try:
+            while True:
+                data = self.status.recv(4096)
+                if not data:
+                    break
+                self.buffer += data
+        except BlockingIOError:
+            return None
+        self.status.close()
+        if not self.buffer:
+            raise OjpackerError(
+                f"zygote exited unexpectedly when running '{self.cmd}'")
+        info = json.loads(self.buffer.decode())
+        self.rusage = rusage(info)
+        self.returncode = utiliy.exit_code(info["status"])
+        return self.returncode
+
+
+def split_execute(file: filetype.execfile,
+                  exe_dir: str = "") -> Tuple[List[str], List[str]]:
+    """
+    execute_cmd around {src}: the interpreter with its flags,
+    and the arguments of the program.
+    empty if {src} is not the script, like "python3 -m mod"
+    """
+    cmd = shlex.split(file.get_execute(exe_dir=exe_dir))
+    if file.src not in cmd[1:]:
+        return [], []
+    index = cmd.index(file.src, 1)
+    if {"-m", "-c"} & set(cmd[1:index]):
+        return [], []
+    return cmd[:index], cmd[index + 1:]
+
+
+@log
+def precheck(file: filetype.execfile) -> None:
+    if file.zygote and not file.src.endswith(".py"):
+        raise OjpackerError(f"zygote only supports python, not '{file.src}'")
+    if file.zygote and not split_execute(file)[0]:
+        raise OjpackerError(
+            f"zygote needs '{file.execute_cmd}' to run {{src}} as the script, "
+            "like 'python3 -O {src} args'")
+
+
+def get_popen(ctx: "context", file: filetype.execfile,
+              **kwargs: Any) -> utiliy.popen:
+    """
+    popen of file with its limits, forked from the zygote if enabled
+    """
+    cmd = file.get_execute(exe_dir=ctx.exe_dir())
+    if file.zygote:
+        return zygote_popen(get(ctx, file), cmd, **kwargs, **file.limits())
+    return utiliy.popen(cmd, **kwargs, **file.limits(), cwd=ctx.root)
+
+
+@log
+def get(ctx: "context", file: filetype.execfile) -> zygote:
+    """
+    one zygote for each generator in a run
+    """
+    if file.src not in ctx.zygotes:
+        ctx.zygotes[file.src] = zygote(file, ctx.exe_dir(), ctx.root)
+    return ctx.zygotes[file.src]
+
+
+@log
+def close_all(ctx: "context") -> None:
+    for server in ctx.zygotes.values():
+        server.close()
+    ctx.zygotes.clear()
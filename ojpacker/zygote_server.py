@@ -0,0 +1,193 @@
+"""
+zygote of python generators, run by the interpreter of the generator:
+    python3 [FLAGS] zygote_server.py SRC FD PRELOAD_JSON ARGS_JSON
+
+the flags of the interpreter apply to the children, ARGS_JSON is their
+sys.argv after SRC.
+
+it imports the modules used by SRC once, then forks a child for every
+request received from the socket FD. only the standard library can be used.
+
+request: a datagram of json limits, with fds [stdin, stdout, status]
+    the pid of child is sent back through status at once,
+    and a json of exit status and resource usage after it exits
+"""
+import array
+import ast
+import importlib
+import json
+import os
+import runpy
+import select
+import signal
+import socket
+import sys
+import traceback
+
+try:
+    import resource
+except ImportError:
+    resource = None  # type: ignore
+
+
+def top_imports(src):
+    """
+    absolute modules imported at the top level of src
+    """
+    with open(src, "rb") as fp:
+        tree = ast.parse(fp.read(), src)
+    names = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            names.append(node.module)
+    return names
+
+
+def preload(src, extra):
+    for name in top_imports(src) + extra:
+        try:
+            importlib.import_module(name)
+        except Exception:
+            pass
+
+
+def recv_request(ctrl):
+    fds = array.array("i")
+    msg, ancdata, _, _ = ctrl.recvmsg(65536, socket.CMSG_SPACE(3 * fds.itemsize))
+    for level, typ, data in ancdata:
+        if level == socket.SOL_SOCKET and typ == socket.SCM_RIGHTS:
+            fds.frombytes(data[:len(data) - (len(data) % fds.itemsize)])
+    return msg, list(fds)
+
+
+def run_child(src, args, limits, stdin_fd, stdout_fd):
+    """
+    in the forked child, never returns
+    """
+    code = 1
+    try:
+        os.setsid()
+        if resource is not None:
+            if limits.get("cpu"):
+                resource.setrlimit(resource.RLIMIT_CPU,
+                                   (limits["cpu"], limits["cpu"] + 1))
+            if limits.get("memory"):
+                resource.setrlimit(resource.RLIMIT_AS,
+                                   (limits["memory"], limits["memory"]))
+            if limits.get("output"):
+                # a byte over the limit, see popen.set_rlimit
+                resource.setrlimit(resource.RLIMIT_FSIZE,
+                                   (limits["output"] + 1, limits["output"] + 1))
+        os.dup2(stdin_fd, 0)
+        os.dup2(stdout_fd, 1)
+        os.close(stdin_fd)
+        os.close(stdout_fd)
+        sys.stdin = open(0, "r", closefd=False)
+        sys.stdout = open(1, "w", closefd=False)
+        # the global state of numpy is not reseeded after fork like random
+        if "numpy.random" in sys.modules:
+            sys.modules["numpy.random"].seed()
+        sys.argv = [src] + args
+        runpy.run_path(src, run_name="__main__")
+        code = 0
+    except SystemExit as err:
+        if err.code is None:
+            code = 0
+        elif isinstance(err.code, int):
+            code = err.code
+        else:
+            print(err.code, file=sys.stderr)
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+        except Exception:
+            code = code or 1
+        os._exit(code)
+
+
+def serve(src, ctrl, extra, args):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(src)))
+    preload(src, extra)
+
+    children = {}
+    rfd, wfd = os.pipe()
+    os.set_blocking(rfd, False)
+    os.set_blocking(wfd, False)
+    signal.set_wakeup_fd(wfd)
+    signal.signal(signal.SIGCHLD, lambda *args: None)
+
+    while True:
+        ready, _, _ = select.select([ctrl, rfd], [], [])
+        if rfd in ready:
+            try:
+                while os.read(rfd, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+            reap(children)
+        if ctrl in ready:
+            msg, fds = recv_request(ctrl)
+            if not msg or msg == b"quit":
+                break
+            stdin_fd, stdout_fd, status_fd = fds
+            status = socket.socket(fileno=status_fd)
+            pid = os.fork()
+            if pid == 0:
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                signal.set_wakeup_fd(-1)
+                os.close(rfd)
+                os.close(wfd)
+                ctrl.close()
+                status.close()
+                for sock in children.values():
+                    sock.close()
+                run_child(src, args, json.loads(msg.decode()), stdin_fd,
+                          stdout_fd)
+            os.close(stdin_fd)
+            os.close(stdout_fd)
+            status.sendall(f"{pid}\n".encode())
+            children[pid] = status
+
+    for pid in children:
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+
+def reap(children):
+    while children:
+        try:
+            pid, status, usage = os.wait4(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+        sock = children.pop(pid, None)
+        if sock is None:
+            continue
+        try:
+            sock.sendall(
+                json.dumps({
+                    "status": status,
+                    "utime": usage.ru_utime,
+                    "stime": usage.ru_stime,
+                    "maxrss": usage.ru_maxrss,
+                }).encode())
+        except OSError:
+            pass
+        sock.close()
+
+
+if __name__ == "__main__":
+    serve(
+        sys.argv[1],
+        socket.socket(fileno=int(sys.argv[2])),
+        json.loads(sys.argv[3]),
+        json.loads(sys.argv[4]),
+    )
@@ -0,0 +1,73 @@
+import os
+import sys
+
+import pytest
+
+from ojpacker import filetype, scheduler, utiliy, zygote
+from ojpacker.error import OjpackerError
+
+limit = 1024 * 1024
+# writes as many bytes as the number read from stdin
+writer = "import sys\nsys.stdout.buffer.write(b'x' * int(input()))\n"
+
+
+def run(job: utiliy.popen) -> None:
+    runner = scheduler.scheduler()
+    runner.add(job)
+    runner.run()
+
+
+@pytest.fixture
+def gen(tmp_path):
+    src = tmp_path / "gen.py"
+    src.write_text(writer)
+    return str(src)
+
+
+@pytest.mark.parametrize("size", [limit - 1, limit])
+def test_popen_within_limit(gen, tmp_path, size):
+    output = str(tmp_path / "out")
+    run(
+        utiliy.popen(f"{sys.executable} {gen}",
+                     typ="s2f",
+                     input=str(size),
+                     output=output,
+                     max_output=limit))
+    assert os.path.getsize(output) == size
+
+
+def test_popen_over_limit(gen, tmp_path):
+    with pytest.raises(OjpackerError, match="output limit"):
+        run(
+            utiliy.popen(f"{sys.executable} {gen}",
+                         typ="s2f",
+                         input=str(limit + 1),
+                         output=str(tmp_path / "out"),
+                         max_output=limit))
+
+
+@pytest.mark.parametrize("size, ok", [(limit, True), (limit + 1, False)])
+def test_zygote_limit(gen, tmp_path, size, ok):
+    file = filetype.get_execfile({
+        "src": gen,
+        "execute_cmd": f"{sys.executable} {{src}}",
+        "zygote": True,
+        "output_limit": 1,
+    })
+    server = zygote.zygote(file)
+    output = str(tmp_path / "out")
+    job = zygote.zygote_popen(server,
+                              file.get_execute(),
+                              typ="s2f",
+                              input=str(size),
+                              output=output,
+                              **file.limits())
+    try:
+        if ok:
+            run(job)
+            assert os.path.getsize(output) == size
+        else:
+            with pytest.raises(OjpackerError, match="output limit"):
+                run(job)
+    finally:
+        server.close()